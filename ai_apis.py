@@ -2,17 +2,16 @@ import os
 import random
 import time
 from decouple import config
-from fp.fp import FreeProxy
 import requests
 import json
-import replicate
 
-import tiktoken
 from utils import prompt, save_profile, say, DEBUG
-from openai import OpenAI
 import os
 import logging
 
+# The model SDKs (openai, replicate, tiktoken, fp) are imported on first use, since importing them takes
+# most of the start-up time of the scripts that only need ask_ai now and then
+
 latest_gpt_model = "gpt-4o"
 
 def ask_ai(content, system_role=None, model="", json_mode=False, always_shorten=None):
@@ -109,6 +108,8 @@ class DynamicAI:
 
     def count_tokens(self, string: str, encoding_name="cl100k_base") -> int:
         """Returns the number of tokens in a text string."""
+        import tiktoken
+
         encoding = tiktoken.get_encoding(encoding_name)
         num_tokens = len(encoding.encode(string))
         return num_tokens
@@ -196,6 +197,8 @@ class DynamicAI:
             str: The generated content based on the prompt.
         """
         
+        from fp.fp import FreeProxy
+
         # Load the last working proxy from the json file
         
         try:
@@ -254,6 +257,8 @@ class DynamicAI:
 
 
     def query_llama3(self, content, system_role):
+        import replicate
+
         if system_role is None:
             system_role = "You are a helpful assistant."
         os.environ["REPLICATE_API_TOKEN"] = config('REPLICATE_API_KEY')
@@ -284,6 +289,8 @@ class DynamicAI:
 
 
     def query_openai(self, content, system_role, model='gpt-4o', json_mode=False):
+        from openai import OpenAI
+
         if system_role is None:
             system_role = "You are a helpful assistant."
 
@@ -104,31 +104,6 @@ def estimate_prompt_difficulty(prompt, tries=0):
     return estimate_prompt_difficulty(prompt, tries+1)
 
 
-def latest_trials_data_by_organization(profile, since=False):
-    url = "https://clinicaltrials.gov/api/v2/studies"
-    response = requests.get(url, timeout=5, params={"query.spons": profile["organization_name"], "pageSize": 1000})
-    # print(json.dumps(response.json()["studies"][0], indent=4))
-    print("Found", len(response.json()["studies"]), "studies for", profile["organization_name"])
-    conditions = []
-    collaborators = []
-    for study in response.json()["studies"]:
-        description = study["protocolSection"]["descriptionModule"]["briefSummary"]
-        conditions += study["protocolSection"]["conditionsModule"]["conditions"]
-        collaborators += [collaborator["name"] for collaborator in study["protocolSection"]["sponsorCollaboratorsModule"].get("collaborators", [])]
-
-    unique_conditions = list(set(conditions))
-    condition_counts = {condition: conditions.count(condition) for condition in unique_conditions}
-    sorted_conditions = sorted(condition_counts.items(), key=lambda x: x[1], reverse=True)
-    profile["top5_conditions"] = sorted_conditions[:5]
-
-    unique_collaborators = list(set(collaborators))
-    collaborator_counts = {collaborator: collaborators.count(collaborator) for collaborator in unique_collaborators}
-    sorted_collaborators = sorted(collaborator_counts.items(), key=lambda x: x[1], reverse=True)
-    profile["top5_collaborators"] = sorted_collaborators[:5]
-    
-    return profile
-
-
 def query_gemini(content, system_role=None):
     # Load the last working proxy from the json file
     try:
@@ -0,0 +1,95 @@
+from datetime import datetime
+import json
+import os
+import threading
+
+
+class RunCheckpoint:
+    """
+    Append-only journal of the work a run has finished, so that a crashed run can be resumed.
+
+    Every finished item is written as one JSON line with its stage, key and intermediate result, and the
+    end of a stage is marked with its own line. Lines are flushed as they are written, so the journal
+    survives a crash. A completed run removes its journal.
+
+    Usage:
+        checkpoint = RunCheckpoint("news/run_checkpoint.jsonl", resume=True)
+        if not checkpoint.done("score", uri):
+            checkpoint.record("score", uri, result)
+    """
+
+    def __init__(self, path, resume=False, params=None):
+        self.path = path
+        self.results = {}
+        self.finished_stages = set()
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._replay()
+            print(f"Resuming the run started at {self.started}: " + ", ".join(f"{stage} {len(items)}" for stage, items in self.results.items()))
+        else:
+            if resume:
+                print("No interrupted run found, starting a new run.")
+            with open(path, "w") as journal:
+                journal.write(json.dumps({"started": self.started, "params": params or {}}) + "\n")
+        self._journal = open(path, "a")
+        if self._journal.tell() and not self._ends_with_newline():
+            # Start the new entries on their own line after an entry cut short by the crash
+            self._journal.write("\n")
+
+    def _replay(self):
+        with open(self.path, "r") as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut short by the crash
+                    continue
+                if "started" in entry:
+                    self.started = entry["started"]
+                elif entry.get("finished"):
+                    self.finished_stages.add(entry["stage"])
+                else:
+                    self.results.setdefault(entry["stage"], {})[entry["key"]] = entry.get("result")
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as journal:
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) == b"\n"
+
+    def _write(self, entry):
+        with self._lock:
+            self._journal.write(json.dumps(entry) + "\n")
+            self._journal.flush()
+
+    def done(self, stage, key):
+        return key in self.results.get(stage, {})
+
+    def result(self, stage, key):
+        return self.results.get(stage, {}).get(key)
+
+    def keys(self, stage):
+        return list(self.results.get(stage, {}).keys())
+
+    def record(self, stage, key, result=None):
+        """
+        Records that the stage has finished the item, together with its intermediate result.
+        """
+        with self._lock:
+            self.results.setdefault(stage, {})[key] = result
+        self._write({"stage": stage, "key": key, "result": result})
+
+    def stage_finished(self, stage):
+        return stage in self.finished_stages
+
+    def finish_stage(self, stage):
+        self.finished_stages.add(stage)
+        self._write({"stage": stage, "finished": True})
+
+    def complete(self):
+        """
+        Marks the run as completed by removing the journal.
+        """
+        with self._lock:
+            self._journal.close()
+            os.remove(self.path)
@@ -0,0 +1,149 @@
+import json
+import re
+import threading
+
+CACHE_FILE = "news/concept_uri_cache.json"
+_EXACT = "\0"
+_UNIQUE = "\1"
+_AMBIGUOUS = ""
+
+
+def normalize_label(label):
+    return re.sub(r"\s+", " ", label).strip().lower()
+
+
+class LabelTrie:
+    """
+    Prefix trie from concept labels to concept URIs.
+
+    Every node remembers the URI of the label that ends there and the URI shared by all labels below it,
+    so both exact and unambiguous prefix lookups take time proportional to the length of the label.
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def insert(self, label, uri):
+        label = normalize_label(label)
+        if not label or not uri:
+            return
+        node = self.root
+        for char in label:
+            node = node.setdefault(char, {})
+            unique = node.get(_UNIQUE)
+            node[_UNIQUE] = uri if unique in (None, uri) else _AMBIGUOUS
+        if _EXACT not in node:
+            self.size += 1
+        node[_EXACT] = uri
+
+    def _node(self, label):
+        node = self.root
+        for char in normalize_label(label):
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def exact(self, label):
+        node = self._node(label)
+        return node.get(_EXACT) if node else None
+
+    def prefix(self, label):
+        """
+        Returns the URI if every known label starting with the given label points to the same concept
+        and the label ends at a word boundary of one of them, e.g. 'hepatitis' for 'hepatitis b' but not 'hepat'.
+        """
+        node = self._node(label)
+        if not node or " " not in node:
+            return None
+        return node.get(_UNIQUE) or None
+
+
+def concept_labels(concept):
+    """
+    Returns all labels and synonyms of a concept in news/concepts.json.
+    """
+    labels = [concept.get("name")]
+    for field in ["label", "synonyms"]:
+        value = concept.get(field)
+        if isinstance(value, dict):
+            for lang_value in value.values():
+                labels += lang_value if isinstance(lang_value, list) else [lang_value]
+        elif isinstance(value, list):
+            labels += value
+        elif isinstance(value, str):
+            labels.append(value)
+    return [label for label in labels if isinstance(label, str) and label]
+
+
+class ConceptLabelResolver:
+    """
+    Resolves concept labels to Event Registry URIs locally where possible.
+
+    The trie is built from every label and synonym in news/concepts.json and from the earlier answers of the
+    suggestConceptsFast API, which are persisted in news/concept_uri_cache.json.
+    """
+
+    def __init__(self, all_concepts=None, cache_file=CACHE_FILE, min_prefix_length=4):
+        self.cache_file = cache_file
+        self.min_prefix_length = min_prefix_length
+        self.trie = LabelTrie()
+        self._lock = threading.Lock()
+        if all_concepts is None:
+            try:
+                with open("news/concepts.json", "r") as json_file:
+                    all_concepts = json.load(json_file)
+            except FileNotFoundError:
+                all_concepts = {"concepts": {}}
+        for uri, concept in all_concepts["concepts"].items():
+            for label in concept_labels(concept):
+                self.trie.insert(label, uri)
+        try:
+            with open(cache_file, "r") as json_file:
+                self.answers = json.load(json_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.answers = {}
+        for label, uri in self.answers.items():
+            self.trie.insert(label, uri)
+
+    def resolve(self, label):
+        """
+        Returns the URI for an exact or unambiguous prefix match, otherwise None.
+
+        A prefix only counts if it is at least min_prefix_length characters long, ends at a word boundary
+        and all known labels starting with it belong to the same concept. Anything else is left to the API.
+        """
+        with self._lock:
+            uri = self.trie.exact(label)
+            if uri is None and len(normalize_label(label)) >= self.min_prefix_length:
+                uri = self.trie.prefix(label)
+        return uri
+
+    def add(self, label, uri, save=True):
+        """
+        Remembers an answer of the API.
+        """
+        with self._lock:
+            self.answers[normalize_label(label)] = uri
+            self.trie.insert(label, uri)
+        if save:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            with open(self.cache_file, "w") as json_file:
+                json.dump(self.answers, json_file, indent=4)
+
+
+_resolver = None
+
+
+def get_resolver():
+    """
+    Returns the shared label resolver of this process.
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = ConceptLabelResolver()
+    return _resolver
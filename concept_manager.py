@@ -1,17 +1,18 @@
 import json
 import math
-from news import load_settings, save_settings
-from utils import choice_menu, toggle
+from utils import choice_menu, load_settings, save_settings, toggle
 
 
 if __name__ == '__main__':
     while True:
         settings = load_settings()
-        choice = choice_menu(settings.keys(), "Which types of concepts would you like to manage?")
+        # The other settings are single values such as thresholds
+        concept_types = [key for key, value in settings.items() if isinstance(value, list)]
+        choice = choice_menu(concept_types, "Which types of concepts would you like to manage?")
         if choice is False:
             print("Thank you, bye!")
             raise SystemExit
-        key = list(settings)[choice]
+        key = concept_types[choice]
         if key == "categories":
             categories = settings[key]
             #TODO add tracked categories
@@ -1,8 +1,7 @@
 import json
 import math
-from utils import choice_menu, toggle
+from utils import choice_menu, load_settings, toggle
 from ai_apis import ask_ai
-from news import load_settings
 
 
 def remove_duplicate_categories():
@@ -121,7 +120,7 @@ def migrate_data():
     settings = load_settings()
     concepts = {"concepts": {}, "classification": {}}
     for key, item in settings.items():
-        if key != "categories":
+        if key != "categories" and isinstance(item, list):
             for concept in item:
                 if concept.get("approved", False):
                     concept["events"] = [event["uri"] for search_object in events.values() for event in search_object["events"] if concept["uri"] in (event["concepts"] if isinstance(event["concepts"][0], list) else [c["uri"] for c in event["concepts"]])]
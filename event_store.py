@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import threading
+
+from utils import load_settings, say
+
+EVENTS_FILE = "news/events.json"
+ARCHIVE_FILE = "news/events_archive.jsonl.gz"
+ARCHIVE_INDEX_FILE = "news/events_archive_index.json"
+# Default of the 'hot_window_days' setting in news/news_settings.json. Events older than this are kept
+# only as stubs in the hot store, since their time score has run out
+HOT_WINDOW_DAYS = 31
+
+# Fields that scoring, summarizing, posting and curation read from the hot store
+HOT_FIELDS = ["uri", "eventDate", "title", "summary", "concepts", "categories", "concept_relevance_score", "ai_relevance_score", "bullets", "main_concept", "main_topic", "duplicate_of", "socialScore"]
+STUB_FIELDS = ["uri", "eventDate", "title", "concepts", "categories", "concept_relevance_score", "ai_relevance_score", "bullets", "main_concept", "main_topic", "duplicate_of"]
+ARTICLE_FIELDS = ["uri", "url", "title", "body", "image", "date"]
+STUB_ARTICLE_FIELDS = ["uri", "url", "title", "image", "date"]
+
+_archive_lock = threading.Lock()
+
+
+def slim_event(event, stub=False):
+    """
+    Returns the hot copy of an event: only the fields that scoring and posting need, and from the stories
+    only the medoid article of the first story. Stubs keep no summary, and their article has no body,
+    so code that reads the first story still works on them.
+    """
+    fields = STUB_FIELDS if stub else HOT_FIELDS
+    slim = {key: event[key] for key in fields if key in event}
+    stories = event.get("stories") or []
+    article = (stories[0] or {}).get("medoidArticle") if stories else None
+    article_fields = STUB_ARTICLE_FIELDS if stub else ARTICLE_FIELDS
+    slim["stories"] = [{"medoidArticle": {key: article[key] for key in article_fields if key in article}}] if article else []
+    if stub:
+        slim["stub"] = True
+    categories = slim.get("categories") or []
+    slim["categories"] = [{"uri": c["uri"], "label": c.get("label")} if isinstance(c, dict) else c for c in categories]
+    slim["archived"] = True
+    return slim
+
+
+def load_archive_index(index_file=ARCHIVE_INDEX_FILE):
+    try:
+        with open(index_file, "r") as json_file:
+            return json.load(json_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def append_to_archive(events, archive_file=ARCHIVE_FILE, index_file=ARCHIVE_INDEX_FILE):
+    """
+    Appends the full payloads of events to the cold archive.
+
+    Every event is written as its own gzip member, and the index keeps the byte offset and length of the
+    latest version of each event, so a single event can be read without decompressing the whole archive.
+    """
+    with _archive_lock:
+        index = load_archive_index(index_file)
+        with open(archive_file, "ab") as archive:
+            for event in events:
+                offset = archive.tell()
+                data = gzip.compress((json.dumps(event) + "\n").encode("utf-8"))
+                archive.write(data)
+                index[event["uri"]] = [offset, len(data)]
+        with open(index_file, "w") as json_file:
+            json.dump(index, json_file)
+
+
+def load_archived_event(uri, archive_file=ARCHIVE_FILE, index_file=ARCHIVE_INDEX_FILE, index=None):
+    """
+    Reads the full payload of an archived event, or returns None if it has not been archived.
+    """
+    if index is None:
+        index = load_archive_index(index_file)
+    if uri not in index:
+        return None
+    offset, length = index[uri]
+    with open(archive_file, "rb") as archive:
+        archive.seek(offset)
+        return json.loads(gzip.decompress(archive.read(length)))
+
+
+def iter_archived_events(archive_file=ARCHIVE_FILE):
+    """
+    Yields every event version in the archive in the order it was written.
+    """
+    if not os.path.exists(archive_file):
+        return
+    with gzip.open(archive_file, "rt") as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def restore_event(event):
+    """
+    Returns the full event, combining the archived payload with the newer fields of the hot copy.
+    """
+    if not event.get("archived"):
+        return event
+    full_event = load_archived_event(event["uri"])
+    if full_event is None:
+        return event
+    full_event.update({key: value for key, value in event.items() if key not in ["stories", "categories", "archived", "stub"]})
+    return full_event
+
+
+def tier_events(window_days=None, events_file=EVENTS_FILE, lock=None):
+    """
+    Moves the heavy payloads of stored events to the compressed cold archive.
+
+    Events inside the window keep the fields scoring and posting need, older events are reduced to stubs.
+    Events that have not been enriched yet are left untouched.
+
+    Args:
+        window_days (int, optional): The age in days until which events are kept hot. Defaults to the 'hot_window_days' setting.
+        events_file (str, optional): The hot store. Defaults to news/events.json.
+        lock (threading.Lock, optional): The lock guarding the hot store.
+
+    Returns:
+        tuple: The size of the hot store in bytes before and after tiering.
+    """
+    if window_days is None:
+        window_days = load_settings().get("hot_window_days", HOT_WINDOW_DAYS)
+    lock = lock or threading.Lock()
+    cutoff = (datetime.today().date() - timedelta(days=window_days)).strftime("%Y-%m-%d")
+    with lock:
+        size_before = os.path.getsize(events_file)
+        with open(events_file, "r") as json_file:
+            events_data = json.load(json_file)
+
+        to_archive = []
+        for uri, event in events_data.items():
+            concepts = event.get("concepts") or []
+            if concepts and not isinstance(concepts[0], str):
+                continue
+            stub = event.get("eventDate", "") < cutoff
+            archived = event.get("archived")
+            if archived and not event.get("stories"):
+                # Stubs written before stubs kept their first story get it back from the archive
+                event = restore_event(event)
+            slim = slim_event(event, stub=stub)
+            if slim == event:
+                continue
+            # The full payload of an event is archived once, later changes only touch the hot fields
+            if not archived:
+                to_archive.append(event)
+            events_data[uri] = slim
+
+        if to_archive:
+            append_to_archive(to_archive)
+        with open(events_file, "w") as json_file:
+            json.dump(events_data, json_file, indent=4)
+        size_after = os.path.getsize(events_file)
+    say(f"Archived {len(to_archive)} events, hot store {round(size_before / 1e6, 1)} MB -> {round(size_after / 1e6, 1)} MB")
+    return size_before, size_after
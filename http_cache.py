@@ -0,0 +1,250 @@
+from datetime import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from decouple import config
+import requests
+
+from utils import say
+
+CACHE_DIR = config("HTTP_CACHE_DIR", default="http_cache")
+# Cached responses are served without asking the server for this many seconds, after that they are revalidated
+DEFAULT_TTL = config("HTTP_CACHE_TTL", default=7 * 24 * 3600, cast=int)
+# The least recently used responses are evicted once the bodies take more than this many bytes
+MAX_CACHE_BYTES = config("HTTP_CACHE_MAX_BYTES", default=500 * 1024 * 1024, cast=int)
+# Serve only cached content and never go to the network
+OFFLINE = config("HTTP_CACHE_OFFLINE", default=False, cast=bool)
+TIMEOUT = (5, 10)
+CHUNK_SIZE = 16 * 1024
+
+
+class CachedResponse:
+    """
+    The parts of an HTTP response that are kept in the cache.
+    """
+
+    def __init__(self, url, status_code, content, headers, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get("Content-Type", "")
+        if "charset=" in content_type:
+            return content_type.split("charset=")[-1].split(";")[0].strip()
+        return "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+
+class HttpCache:
+    """
+    Content-addressed on-disk cache of GET responses.
+
+    Bodies are stored once per SHA-256 of their content under cache_dir/bodies, and an index maps every URL
+    to its body, its ETag and Last-Modified headers and the time it was fetched. Responses younger than the
+    TTL are served from disk, older ones are revalidated with a conditional request so that unchanged pages
+    are not downloaded again. Bodies cut short by max_bytes are marked as truncated and downloaded again
+    for callers that read further. In offline mode only cached responses are served, however old.
+
+    Usage:
+        response = get_cache().get(url)
+        if response and response.status_code == 200:
+            html = response.text
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=MAX_CACHE_BYTES, offline=OFFLINE):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(cache_dir, "bodies"), exist_ok=True)
+        try:
+            with open(self.index_file, "r") as json_file:
+                self.index = json.load(json_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+
+    def _body_path(self, digest):
+        return os.path.join(self.cache_dir, "bodies", digest[:2], digest)
+
+    def _read_body(self, entry):
+        try:
+            with open(self._body_path(entry["hash"]), "rb") as body_file:
+                return body_file.read()
+        except FileNotFoundError:
+            return None
+
+    def _cached(self, url, entry, max_bytes=None):
+        content = self._read_body(entry)
+        if content is None:
+            return None
+        with self._lock:
+            entry["used"] = time.time()
+        return CachedResponse(url, entry["status"], content[:max_bytes] if max_bytes else content, entry["headers"], from_cache=True)
+
+    @staticmethod
+    def _covers(entry, max_bytes):
+        """
+        Returns whether the cached body is complete, or at least as long as the caller reads.
+        """
+        return not entry.get("truncated") or bool(max_bytes and max_bytes <= entry["size"])
+
+    def get(self, url, session=None, ttl=None, max_bytes=None, timeout=TIMEOUT, headers=None):
+        """
+        Returns the response to a GET request of the URL, from the cache if possible.
+
+        Args:
+            url (str): The URL.
+            session (requests.Session, optional): The session used for the request. Defaults to plain requests.
+            ttl (int, optional): Serve cached responses younger than this many seconds. Defaults to the TTL of the cache.
+            max_bytes (int, optional): Read at most this many bytes of the body. Defaults to the whole body.
+            timeout (tuple, optional): The connect and read timeouts of the request.
+            headers (dict, optional): Additional request headers.
+
+        Returns:
+            CachedResponse: The response, or None if the request failed or the URL is not cached in offline mode.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            entry = self.index.get(url)
+        # A body cut short by an earlier max_bytes cannot serve a caller that reads further
+        covers = entry is not None and self._covers(entry, max_bytes)
+        if entry and (self.offline or (covers and time.time() - entry["fetched"] < ttl)):
+            cached = self._cached(url, entry, max_bytes)
+            if cached:
+                return cached
+        if self.offline:
+            say(f"Offline, {url} is not cached")
+            return None
+
+        request_headers = dict(headers or {})
+        # Validators are only sent for a usable body, a 304 would otherwise confirm a truncated one
+        if covers and entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
+        if covers and entry.get("last_modified"):
+            request_headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with (session or requests).get(url, headers=request_headers, timeout=timeout, stream=True) as response:
+                status = response.status_code
+                if status != 304:
+                    content = bytearray()
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        content += chunk
+                        if max_bytes and len(content) >= max_bytes:
+                            break
+                    truncated = bool(max_bytes) and len(content) >= max_bytes
+                    content = bytes(content[:max_bytes] if max_bytes else content)
+                    kept_headers = {name: response.headers[name] for name in ["Content-Type", "ETag", "Last-Modified"] if name in response.headers}
+        except requests.exceptions.RequestException as e:
+            say(f"Could not fetch {url}: {e}")
+            # A stale copy is better than nothing
+            return self._cached(url, entry, max_bytes) if entry else None
+
+        if status == 304 and covers:
+            cached = self._cached(url, entry, max_bytes)
+            if cached:
+                with self._lock:
+                    entry["fetched"] = time.time()
+                self.save()
+                return cached
+            # The body has been evicted, so the page is requested again without the validators
+            with self._lock:
+                if self.index.get(url) is entry:
+                    del self.index[url]
+            return self.get(url, session=session, ttl=ttl, max_bytes=max_bytes, timeout=timeout, headers=headers)
+        if status == 304:
+            return None
+        if status == 200:
+            self.store(url, status, content, kept_headers, truncated)
+        return CachedResponse(url, status, content, kept_headers)
+
+    def store(self, url, status, content, headers, truncated=False):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._body_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Other threads may be storing the same body, so each writes a temporary file of its own
+            descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "wb") as body_file:
+                    body_file.write(content)
+                os.replace(temporary_path, path)
+            except OSError:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                # The body is stored already if another thread got there first
+                if not os.path.exists(path):
+                    raise
+        now = time.time()
+        with self._lock:
+            self.index[url] = {
+                "hash": digest,
+                "size": len(content),
+                "truncated": truncated,
+                "status": status,
+                "headers": headers,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "fetched": now,
+                "used": now,
+                "date": datetime.now().isoformat(timespec="seconds")
+            }
+            self.evict()
+            self.save()
+
+    def evict(self):
+        """
+        Removes the least recently used responses until the bodies fit in max_bytes.
+        """
+        with self._lock:
+            sizes = {entry["hash"]: entry["size"] for entry in self.index.values()}
+            total = sum(sizes.values())
+            if total <= self.max_bytes:
+                return
+            references = {}
+            for entry in self.index.values():
+                references[entry["hash"]] = references.get(entry["hash"], 0) + 1
+            for url, entry in sorted(self.index.items(), key=lambda item: item[1]["used"]):
+                if total <= self.max_bytes:
+                    break
+                del self.index[url]
+                references[entry["hash"]] -= 1
+                if not references[entry["hash"]]:
+                    total -= entry["size"]
+                    try:
+                        os.remove(self._body_path(entry["hash"]))
+                    except FileNotFoundError:
+                        pass
+
+    def save(self):
+        with self._lock:
+            with open(self.index_file + ".tmp", "w") as json_file:
+                json.dump(self.index, json_file)
+            os.replace(self.index_file + ".tmp", self.index_file)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the HTTP cache shared by this process.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache()
+    return _cache
@@ -1,37 +1,55 @@
 import random
-import re
+import threading
 import time
-import googlesearch
 import concurrent.futures
 from decouple import config
 import requests
-from bs4 import BeautifulSoup
-from utils import choice_menu, load_profile, load_profiles, load_questions, prompt, save_profile, save_question, say
-from trials import latest_trials_data_by_condition, latest_trials_data_by_organization
+from utils import choice_menu, load_coverage, load_profile, load_profiles, load_questions, prompt, save_profile, save_question, say
+from trials import get_all_studies, latest_trials_data_by_condition, latest_trials_data_by_organization
+from trials_query import TrialQueryEngine
 import json
 from ai_apis import ask_ai
+from org_questions import QuestionCoverage, answer_question
+from page_text import extract_text
 
 savefile = "profiles_gemini.json"
+# Concurrency limits of the stages of compile_profile, shared by all the organizations analyzed at once
+llm_slots = threading.BoundedSemaphore(config("LLM_CONCURRENCY", default=6, cast=int))
+search_slots = threading.BoundedSemaphore(config("SEARCH_CONCURRENCY", default=1, cast=int))
+web_slots = threading.BoundedSemaphore(config("WEB_CONCURRENCY", default=8, cast=int))
 
 
 def analyze_organization(organization_name):
     # try:
     profile = compile_profile(organization_name)
     print(f'{profile["relevance"]}/10 - {organization_name}: {profile["shortly"]}')
+    return profile
     # except replicate.exceptions.ModelError as e:
     #     print("Could not analyze organization", organization_name, "due to the following error:", e)
 
-def analyze_organizations(filename):
+def analyze_organizations(filename, workers=8):
+    """
+    Compiles the profiles of the organizations listed in the file, several organizations at a time.
+    The stages of compile_profile share the concurrency limits llm_slots, search_slots and web_slots,
+    and every profile is saved as soon as it is complete.
+    """
     with open(filename, "r") as file:
         lines = file.readlines()
     
-    organization_names = [line.strip() for line in lines]
-
-    # with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-    #     executor.map(analyze_organization, organization_names)
+    organization_names = [line.strip() for line in lines if line.strip()]
 
-    for organization_name in organization_names:
-        analyze_organization(organization_name)
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyze_organization, organization_name): organization_name for organization_name in organization_names}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"Could not analyze {futures[future]}: {e}")
+            print(f"[{done}/{len(organization_names)}] organizations analyzed")
+    if failed:
+        print("Failed organizations:", ", ".join(failed))
 
 def analyze_trials():
     profiles = load_profiles(savefile)
@@ -58,163 +76,89 @@ def ask_question():
     if not property_name or property_name in next(iter(profiles.values())).keys():
         return False
     
-    if property_type == "integer":
-        instruction = "Please provide an integer value as the answer and nothing else."
-    elif property_type == "string":
-        instruction = "Please provide an answer without any additional information (e.g. <here's the answer>)."
-    elif property_type == "float":
-        instruction = "Please provide a float value as the answer and nothing else."
-    elif property_type == "boolean":
-        instruction = "Please provide a boolean value (True or False) as the answer and nothing else"
-    elif property_type == "list":
-        instruction = "Please provide a JSON list as the answer and nothing else."
-    elif property_type == "dictionary":
-        instruction = "Please provide a JSON dictionary value as the answer and nothing else."
-    else:
-        instruction = "Please provide an answer without any additional information (e.g. <here's the answer>)."
-
     save_question(savefile, (q.replace('?',''), property_name, property_type))
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        executor.map(
-            ask_an_organization,
-            profiles.keys(),
-            [q]*len(profiles),
-            [instruction]*len(profiles),
-            [property_name]*len(profiles),
-            [property_type]*len(profiles))
+    answer_question(profiles, q, property_name, property_type, savefile)
     
 
-def ask_an_organization(organization_name, q, instruction, property_name, property_type):
-    profile = load_profile(savefile, organization_name)
-    if q[1] in profile.keys():
-        return None
-    answer = ask_ai(f"I would like to know something about an organization called {organization_name} with context of improving child and adolescent health in developing countries. Please give a conscise answer to question: {q.replace('?','')}? {instruction}")
-    if answer:
-        try:
-            if property_type == "integer":
-                profile[property_name] = int(answer)
-            elif property_type == "string":
-                profile[property_name] = answer
-            elif property_type == "float":
-                profile[property_name] = float(answer)
-            elif property_type == "boolean":
-                profile[property_name] = bool(answer)
-            elif property_type == "list":
-                profile[property_name] = json.loads(answer)
-            elif property_type == "dictionary":
-                profile[property_name] = json.loads(answer)
-            else:
-                profile[property_name] = answer
-        except ValueError:
-            profile[property_name] = None
-        
-        print(f"{organization_name}: {profile[property_name]}")
-
-        save_profile(savefile, organization_name, profile)
-
-
 def finish_question():
     profiles = load_profiles(savefile)
-    all_questions = []
-    for organization_name, profile in profiles.items():
-        if not profile.get("questions", False):
-            continue
-        all_questions += profile["questions"]
-    
-    unique_qs = list(set([q[0] for q in all_questions]))
-    unique_questions = []
-    for q in unique_qs:
-        for question in all_questions:
-            if question[0] == q:
-                unique_questions.append(question)
-
-    unanswered_questions = []
-    for question in unique_questions:
-        for organization_name, profile in profiles.items():
-            if question not in unanswered_questions and question not in profile["questions"]:
-                unanswered_questions.append(question)
-                break
-    choice = choice_menu([q[0] for q in unanswered_questions], "Which question would you like to complete?")
+    coverage = QuestionCoverage.from_json(load_coverage(savefile))
+    unanswered_questions = coverage.unanswered_questions()
+    if not unanswered_questions:
+        print("Every question has been answered for every organization.")
+        return
+    choice = choice_menu([f"{q[0]} ({len(coverage.missing(q[1]))} missing)" for q in unanswered_questions], "Which question would you like to complete?")
     if choice is not False:
-        question, property_name, property_type = unanswered_questions[choice]    
-        if property_type == "integer":
-            instruction = "Please provide an integer value as the answer and nothing else."
-        elif property_type == "string":
-            instruction = ""
-        elif property_type == "float":
-            instruction = "Please provide a float value as the answer and nothing else."
-        elif property_type == "boolean":
-            instruction = "Please provide a boolean value (True or False) as the answer and nothing else"
-        elif property_type == "list":
-            instruction = "Please provide a JSON list as the answer and nothing else."
-        elif property_type == "dictionary":
-            instruction = "Please provide a JSON dictionary value as the answer and nothing else."
-        else:
-            instruction = ""
-        params = []
-        for organization_name, profile in profiles.items():
-            if question not in [q[0] for q in profile["questions"]]:
-                params.append((organization_name, question, instruction, property_name, property_type))
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            executor.map(
-                ask_an_organization,
-                *[[p[i] for p in params] for i in range(len(params[0]))])
+        question, property_name, property_type = unanswered_questions[choice]
+        answer_question(profiles, question, property_name, property_type, savefile, coverage=coverage)
 
 
+def limited_ask_ai(*args, **kwargs):
+    with llm_slots:
+        return ask_ai(*args, **kwargs)
 
-def compile_profile(organization_name):
-    profile = load_profile(savefile, organization_name)
-    if not profile:
-        # Create a new profile for the organization
-        print("\tAnalyzing organization:", organization_name, "...")
-        profile = {
-            "organization_name": organization_name,
-            "ai_summary": ask_ai(f"Please write a profile on an organization called {organization_name} and summarize its current operations and goals. Please only write the profile and no meta information (e.g. <here's the overview>)")
-        }
-        say("Organization shortly")
-        profile["shortly"] = ask_ai(f"Please write a short summary (without meta information, e.g. here's a short summary) of the organization {organization_name} in one sentence based on this longer description:\n{profile['ai_summary']}")
-        say("Finding initiatives")
-        profile["ai_recent_initiatives"] = ask_ai(f"What are the most recent initiatives, publications, treatments or trials driven by {organization_name}?")
-        # Search for information about the organization on Google
-        say("Searching google...")
-        search_query = f"{organization_name} information"
+
+def search_organization(organization_name):
+    """
+    Returns the URLs of the top Google search results on the organization.
+    """
+    import googlesearch
+
+    search_query = f"{organization_name} information"
+    with search_slots:
         try:
             search_results = googlesearch.search(search_query, num_results=5, sleep_interval=5)
         except requests.exceptions.HTTPError as e:
             time.sleep(random.random()*5)
             search_results = googlesearch.search(search_query, num_results=5, sleep_interval=5)
-        
-        profile["search_urls"] = []
+
+        search_urls = []
         for url in search_results:
-            profile["search_urls"].append(url)
+            search_urls.append(url)
             time.sleep(random.random()*1)
+    return search_urls
 
-        # Compile the search results into a single string
-        # Make a GET request to each URL in search_results and extract text
-        search_text = ""
-        for url in profile["search_urls"]:
-            try:
-                response = requests.get(url, timeout=5)
-            except requests.exceptions.SSLError:
-                continue
-            except requests.exceptions.ReadTimeout:
-                say("Read timeout for", url)
-                continue
-
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                visible_text = soup.get_text()
-                search_text += visible_text + "\n"
-
-        search_text = re.sub(r"\n+", "\n", search_text)
-        search_text = re.sub(r"\s+", " ", search_text)
-
-        say("Search text complete")
-        profile["search_text"] = search_text
-        profile["summary"] = ask_ai(f"Please summarize the information about {organization_name} extracted from various websites below and write a profile about the organization. Please only write the overview and no meta information (e.g. <here's the overview>):\n{search_text}")
-        profile["relevance"] = ask_ai(f"Please give an integer score between 0 and 10 for the relevance of {organization_name} in improving the health of children and adolescents in developing countries. Only provide the integer score and nothing else.")
+
+def fetch_search_text(urls):
+    """
+    Downloads the pages and compiles their visible text into a single string under the token budget of the summary prompt.
+    """
+    return extract_text(urls, slots=web_slots)
+
+
+def compile_profile(organization_name):
+    profile = load_profile(savefile, organization_name)
+    if not profile:
+        # Create a new profile for the organization
+        print("\tAnalyzing organization:", organization_name, "...")
+        # The prompts that do not depend on each other and the Google search run at the same time
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            ai_summary = executor.submit(limited_ask_ai, f"Please write a profile on an organization called {organization_name} and summarize its current operations and goals. Please only write the profile and no meta information (e.g. <here's the overview>)")
+            say("Finding initiatives")
+            ai_recent_initiatives = executor.submit(limited_ask_ai, f"What are the most recent initiatives, publications, treatments or trials driven by {organization_name}?")
+            # Search for information about the organization on Google
+            say("Searching google...")
+            search_urls = executor.submit(search_organization, organization_name)
+            relevance = executor.submit(limited_ask_ai, f"Please give an integer score between 0 and 10 for the relevance of {organization_name} in improving the health of children and adolescents in developing countries. Only provide the integer score and nothing else.")
+
+            say("Organization shortly")
+            shortly = executor.submit(limited_ask_ai, f"Please write a short summary (without meta information, e.g. here's a short summary) of the organization {organization_name} in one sentence based on this longer description:\n{ai_summary.result()}")
+
+            search_text = fetch_search_text(search_urls.result())
+            say("Search text complete")
+            summary = limited_ask_ai(f"Please summarize the information about {organization_name} extracted from various websites below and write a profile about the organization. Please only write the overview and no meta information (e.g. <here's the overview>):\n{search_text}")
+
+            profile = {
+                "organization_name": organization_name,
+                "ai_summary": ai_summary.result(),
+                "shortly": shortly.result(),
+                "ai_recent_initiatives": ai_recent_initiatives.result(),
+                "search_urls": search_urls.result(),
+                "search_text": search_text,
+                "summary": summary,
+                "relevance": relevance.result()
+            }
 
         save_profile(savefile, organization_name, profile)
 
@@ -230,37 +174,85 @@ def gather_trials():
         json.dump(data, file, indent=4)
 
 
-mode = True
-while mode is not False:
-    menu = ["Investigate organizations", "Investigate conditions"]
-    mode = choice_menu(menu, "Where would you like to focus?")
-    if mode is not False:
-        if menu[mode] == "Investigate organizations":
-            choice = True
-            while choice is not False:
-                choices = ["Ask a question", "Complete data on already asked question", "Update profiles (from players.txt)", "Parse clinical trials data"]
-                choice = choice_menu(choices, "What would you like to do?")
-                if choice is not False:
-                    if choices[choice] == "Ask a question":
-                        ask_question()
-                    elif choices[choice] == "Complete data on already asked question":
-                        finish_question()
-                    elif choices[choice] == "Update profiles (from players.txt)":
-                        analyze_organizations("players.txt")
-                    elif choices[choice] == "Parse clinical trials data":
-                        analyze_trials()
-                else:
-                    break
-        elif menu[mode] == "Investigate conditions":
-            choice = True
-            while choice is not False:
-                choices = ["Find trials for conditions"]
-                choice = choice_menu(choices, "What would you like to do?")
-                if choice is not False:
-                    if choices[choice] == "Find trials for conditions":
-                        gather_trials()
-                else:
-                    break
-
-
-print("Bye!")
+def search_trials(engine=None):
+    """
+    Asks for filters in the console and lists the matching trials of the local archive.
+    Empty answers skip the filter.
+    """
+    engine = engine or TrialQueryEngine(get_all_studies(compact=True))
+    query = engine.query()
+    condition = input("Condition (e.g. malaria):\n").strip()
+    if condition:
+        query.condition(condition)
+    min_phase = input("Minimum phase (EARLY_PHASE1, PHASE1, PHASE2, PHASE3, PHASE4):\n").strip()
+    if min_phase:
+        try:
+            query.min_phase(min_phase)
+        except KeyError:
+            print("Unknown phase, ignoring the phase filter.")
+    statuses = input("Overall statuses, comma separated (e.g. RECRUITING, NOT_YET_RECRUITING):\n").strip()
+    if statuses:
+        query.status(*[status.strip() for status in statuses.split(",")])
+    sponsor = input("Lead sponsor:\n").strip()
+    if sponsor:
+        query.sponsor(sponsor)
+    collaborator = input("Collaborator:\n").strip()
+    if collaborator:
+        query.collaborator(collaborator)
+    since = input("Updated since (YYYY-MM-DD):\n").strip()
+    if since:
+        query.updated(since)
+    min_relevance = input("Minimum relevance (0-100):\n").strip()
+    if min_relevance.isdigit():
+        query.min_relevance(int(min_relevance))
+    if prompt("Only trials enrolling children?", default=False):
+        query.age("CHILD")
+    query.sort_by("last_update" if prompt("Sort by last update instead of relevance?", default=False) else "relevance")
+
+    start = time.time()
+    studies = query.limit(20).studies()
+    say(f"Query took {(time.time() - start) * 1000:.1f} ms")
+    print(f"{query.count()} trials found{', showing the first 20' if query.count() > 20 else ''}:")
+    for study in studies:
+        phases = ", ".join(study.phases)
+        print(f'{study.relevance if study.relevance is not None else "-"}\t[{phases}{": " if phases else ""}{study.overall_status}] {study.brief_title} ({study.last_update_submit_date or ""}) {study.url}')
+    return studies
+
+
+if __name__ == "__main__":
+    mode = True
+    while mode is not False:
+        menu = ["Investigate organizations", "Investigate conditions"]
+        mode = choice_menu(menu, "Where would you like to focus?")
+        if mode is not False:
+            if menu[mode] == "Investigate organizations":
+                choice = True
+                while choice is not False:
+                    choices = ["Ask a question", "Complete data on already asked question", "Update profiles (from players.txt)", "Parse clinical trials data"]
+                    choice = choice_menu(choices, "What would you like to do?")
+                    if choice is not False:
+                        if choices[choice] == "Ask a question":
+                            ask_question()
+                        elif choices[choice] == "Complete data on already asked question":
+                            finish_question()
+                        elif choices[choice] == "Update profiles (from players.txt)":
+                            analyze_organizations("players.txt")
+                        elif choices[choice] == "Parse clinical trials data":
+                            analyze_trials()
+                    else:
+                        break
+            elif menu[mode] == "Investigate conditions":
+                choice = True
+                while choice is not False:
+                    choices = ["Find trials for conditions", "Search trials in the archive"]
+                    choice = choice_menu(choices, "What would you like to do?")
+                    if choice is not False:
+                        if choices[choice] == "Find trials for conditions":
+                            gather_trials()
+                        elif choices[choice] == "Search trials in the archive":
+                            search_trials()
+                    else:
+                        break
+
+
+    print("Bye!")
@@ -0,0 +1,91 @@
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# Mersenne prime for the universal hash functions, small enough that a * x + b fits in 64 bits
+_PRIME = np.uint64((1 << 31) - 1)
+
+
+def shingles(text, size=5):
+    """
+    Returns the hashes of the overlapping word n-grams of the text.
+    """
+    words = re.findall(r"\w+", (text or "").lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.array(sorted(set(zlib.crc32(gram.encode("utf-8")) for gram in grams)), dtype=np.uint64) % _PRIME
+
+
+def choose_bands(num_perm, threshold):
+    """
+    Picks the number of LSH bands and rows per band with the most rows whose candidate threshold (1/b)^(1/r)
+    is still at or below the given one. A cut-off above the threshold would miss most pairs right at it.
+    """
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+    if not below:
+        return num_perm, 1
+    return max(below, key=lambda option: option[1])
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of text documents for finding near-verbatim copies without comparing every pair.
+
+    Documents are reduced to MinHash signatures over word shingles. Signatures are split into bands, and
+    documents that share a band are compared by their estimated Jaccard similarity.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, int(_PRIME), size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, int(_PRIME), size=num_perm).astype(np.uint64)
+        self.signatures = {}
+        self.buckets = [{} for _ in range(self.bands)]
+        self._lock = threading.Lock()
+
+    def signature(self, text):
+        hashes = shingles(text)
+        if not len(hashes):
+            return None
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % _PRIME).min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, text):
+        """
+        Adds a document to the index. Documents without any words are ignored.
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return
+        with self._lock:
+            self.signatures[key] = signature
+            for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+                bucket.setdefault(band_key, set()).add(key)
+
+    def query(self, text):
+        """
+        Returns the keys of the indexed documents at least as similar as the threshold, most similar first.
+
+        Returns:
+            list: Tuples of the document key and the estimated Jaccard similarity.
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return []
+        with self._lock:
+            candidates = set()
+            for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+                candidates |= bucket.get(band_key, set())
+            similarities = [(key, float(np.mean(self.signatures[key] == signature))) for key in candidates]
+        matches = [(key, similarity) for key, similarity in similarities if similarity >= self.threshold]
+        return sorted(matches, key=lambda match: match[1], reverse=True)
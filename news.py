@@ -1,30 +1,55 @@
+import argparse
 from datetime import datetime, timedelta
 import math
 import os
-import re
 from decouple import config
 import json
-import numpy as np
+import threading
 import requests
 
 from ai_apis import ask_ai
+from checkpoints import RunCheckpoint
+import concept_labels
+import event_store
+from pipeline import Gate, Pipeline, Stage
+from slack_delivery import SlackDeliveryQueue
 from slack_api import post_on_slack
-from utils import post_to_slack, say
-import requests
-from bs4 import BeautifulSoup
-import matplotlib.pyplot as plt
+from utils import load_settings, say
+import wiki_intros
+
+# NumPy and matplotlib are imported where they are used, so that the curation tools start quickly
 
 
 API_KEY = config('NEWSREGISTRY_API_KEY')
+# Default of the 'duplicate_threshold' setting in news/news_settings.json
+DUPLICATE_THRESHOLD = 0.8
+# Guards the read-modify-write cycles of the news/*.json files when pipeline stages run in parallel
+_store_lock = threading.RLock()
 # TODO: Events are associated with concepts through uri, and the event data can be found in another dictionary with the uri to avoid duplication (otherwise, the event will be added to every concept)
 
 
-def search_and_post_on_slack(new_only=True, relevance_threshold=100, max_posts=5, force_search=False):
+def search_and_post_on_slack(new_only=True, relevance_threshold=100, max_posts=5, force_search=False, top_k=None, workers=4, digest_size=1, resume=False):
     """
     Searches for latest events, assesses their relevance, and posts relevant events on Slack.
 
+    The run is a staged pipeline of fetch, persist, enrich (concepts and translation), score, summarize and post.
+    The stages are connected by bounded queues and run at the same time, so waiting for the news API, the AI
+    models and the disk overlaps. Scored events pass a gate that releases them best first once every event has
+    been scored. They are summarized one at a time in that order, so that the novelty check of every event sees
+    the events chosen before it, and no more events are summarized once max_posts events have been chosen.
+
+    Every stage records the events it has finished in news/run_checkpoint.jsonl. If a run is interrupted, a run
+    with resume=True replays the journal and only does the remaining work.
+
     Args:
         new_only (bool, optional): If True, only assesses and posts new events. Defaults to True.
+        relevance_threshold (int, optional): The minimum relevance score for an event to be posted. Defaults to 100.
+        max_posts (int, optional): The maximum number of events to post. Defaults to 5.
+        force_search (bool, optional): If True, searches even if a search was already made today. Defaults to False.
+        top_k (int, optional): The maximum number of events released for summarization. Defaults to three times max_posts.
+        workers (int, optional): The number of worker threads in each of the enrich and score stages. Defaults to 4.
+        digest_size (int, optional): The number of events combined into one Slack message. Defaults to 1.
+        resume (bool, optional): If True, continues the interrupted previous run. Defaults to False.
 
     Returns:
         None
@@ -35,28 +60,189 @@ def search_and_post_on_slack(new_only=True, relevance_threshold=100, max_posts=5
             slack_posts = json.load(json_file)
     except:
         slack_posts = []
-    
-    all_events, new_events = search_latest_events(force_search=force_search)
+    posted_uris = set(e["uri"] for e in slack_posts)
+    duplicate_index = build_duplicate_index(slack_posts)
 
-    iter_events = new_events if new_only else all_events
-    if iter_events:
-        print("Assessing relevance of the events...")
-    else:
-        print("No news posted on Slack.")
-        return
+    with open("news/concepts.json", "r") as json_file:
+        all_concepts = json.load(json_file)
+    with _store_lock:
+        with open("news/events.json", "r") as json_file:
+            stored_events = json.load(json_file)
+    stored_uris = set(stored_events.keys())
+
+    checkpoint = RunCheckpoint("news/run_checkpoint.jsonl", resume=resume, params={"new_only": new_only, "relevance_threshold": relevance_threshold, "max_posts": max_posts})
+    seen_uris = set()
     scores = {}
-    for event in iter_events:
-        if event.get("concept_relevance_score"):
-            scores[event["uri"]], event["concept_relevance_score"], event["ai_relevance_score"] = measure_event_relevance(event)
+    # The number of events that Slack has accepted
+    posts_so_far = [0]
+    # The events chosen for posting that are not delivered yet, compared against by the novelty check
+    chosen_posts = []
+    posts_lock = threading.Lock()
+    posts_changed = threading.Condition(posts_lock)
+
+    # Events that were delivered before the interruption may be missing from the ledger
+    for uri in checkpoint.keys("post"):
+        posts_so_far[0] += 1
+        if uri not in posted_uris and uri in stored_events:
+            slack_posts.append(event_store.restore_event(stored_events[uri]))
+            posted_uris.add(uri)
+            add_post_to_duplicate_index(duplicate_index, slack_posts[-1])
+    def fetch(emit):
+        def emit_events(events):
+            for event in events:
+                if event["uri"] not in seen_uris:
+                    seen_uris.add(event["uri"])
+                    checkpoint.record("fetch", event["uri"])
+                    emit(event)
+        # Events fetched before the interruption are read back from the store instead of searched again
+        for uri in checkpoint.keys("fetch"):
+            if uri in stored_events and uri not in seen_uris:
+                seen_uris.add(uri)
+                emit(stored_events[uri])
+        if not checkpoint.stage_finished("fetch"):
+            all_events, new_events = search_latest_events(force_search=force_search, save=False, on_events=emit_events)
+            if not new_only:
+                emit_events(all_events)
+            checkpoint.finish_stage("fetch")
+
+    def persist(event):
+        # Raw events are stored first, so nothing that has been fetched is lost
+        if event["uri"] not in stored_uris:
+            save_event(event, enrich=False)
+            stored_uris.add(event["uri"])
+        return event
+
+    def enrich(event):
+        if event.get("stub") or (event.get("archived") and not event.get("stories")):
+            # Stubs of old events need their archived payload for summarizing and posting
+            event = event_store.restore_event(event)
+        if event.get("concepts") and not isinstance(event["concepts"][0], str):
+            event = enrich_event(event, all_concepts)
+            event = save_event(event, update=True)
+        checkpoint.record("enrich", event["uri"])
+        return event
+
+    def score(event):
+        if checkpoint.done("score", event["uri"]):
+            event["concept_relevance_score"], event["ai_relevance_score"] = checkpoint.result("score", event["uri"])
+            return event
+        if not event.get("concept_relevance_score") or not event.get("ai_relevance_score"):
+            _, event["concept_relevance_score"], event["ai_relevance_score"] = measure_event_relevance(event, all_concepts)
+            event = save_event(event, update=True)
+        checkpoint.record("score", event["uri"], [event["concept_relevance_score"], event["ai_relevance_score"]])
+        return event
+
+    def rank(events):
+        from relevance import ConceptScoreIndex, score_events
+
+        # Concept scores follow the current curation, so all events are scored together
+        with _store_lock:
+            index = ConceptScoreIndex(all_concepts)
+        total_scores, concept_scores, _ = score_events(events, index)
+        for i, event in enumerate(events):
+            scores[event["uri"]] = float(total_scores[i])
+            event["concept_relevance_score"] = float(concept_scores[i])
+        if events:
+            print(f"Assessed relevance of {len(events)} events. Summarizing content and posting on Slack...")
+
+    def summarize(event):
+        # A single worker summarizes the released events best first, so the novelty check of every event
+        # sees the events chosen before it, and no summaries are made once enough events have been chosen
+        with posts_changed:
+            # Wait for the deliveries in flight when they would fill the posts, a failed one frees its slot
+            while posts_so_far[0] < max_posts and posts_so_far[0] + len(chosen_posts) >= max_posts:
+                posts_changed.wait()
+            if posts_so_far[0] >= max_posts:
+                return None
+            previous_posts = slack_posts + chosen_posts
+        title = event["title"] if isinstance(event.get("title"), str) else event["title"].get("eng", "No title available")
+        if checkpoint.done("summarize", event["uri"]):
+            summary = checkpoint.result("summarize", event["uri"])
+            event.update(summary["fields"])
+            is_important = summary["is_important"]
         else:
-            scores[event["uri"]], event["concept_relevance_score"], event["ai_relevance_score"] = measure_event_relevance(event)
+            event, is_important = novel_summary(event, previous_posts, duplicate_index)
             event = save_event(event, update=True)
-    
-    
-    # Plot the relevance scores on a bar plot with bins of 5, bar height being the count of events in that bin
-    relevance_scores = list(scores.values())
+            checkpoint.record("summarize", event["uri"], {"is_important": is_important, "fields": {key: event[key] for key in ["bullets", "main_concept", "main_topic", "duplicate_of"] if key in event}})
+        if not is_important:
+            say(f"The news article '{title}' is overlapping too much with the past content and was not posted.")
+            return None
+        with posts_lock:
+            chosen_posts.append(event)
+        add_post_to_duplicate_index(duplicate_index, event)
+        return event
+
+    def post(event):
+        def delivered():
+            # The ledger only lists events that Slack has accepted
+            title = event["title"] if isinstance(event.get("title"), str) else event["title"].get("eng", "No title available")
+            print(f"\n{event.get('eventDate', '')} - {title}")
+            checkpoint.record("post", event["uri"])
+            with posts_changed:
+                chosen_posts.remove(event)
+                slack_posts.append(event)
+                posts_so_far[0] += 1
+                if posts_so_far[0] >= max_posts:
+                    news_pipeline.stop()
+                posts_changed.notify_all()
+
+        def failed():
+            with posts_changed:
+                chosen_posts.remove(event)
+                posts_changed.notify_all()
+
+        # Delivery happens in the background, so the next events are summarized meanwhile
+        try:
+            slack.submit(event_slack_block(event, scores.get(event["uri"], 0), all_concepts), True, on_success=delivered, on_failure=failed, key=event["uri"])
+        except Exception:
+            failed()
+            raise
+        return event
+
+    news_pipeline = Pipeline(fetch, [
+        Stage("persist", persist, workers=1),
+        Stage("enrich", enrich, workers=workers),
+        Stage("score", score, workers=workers),
+        Gate(
+            "top-k",
+            key=lambda event: scores[event["uri"]],
+            top_k=top_k if top_k is not None else max_posts * 3,
+            condition=lambda event: scores[event["uri"]] >= relevance_threshold and event["uri"] not in posted_uris,
+            on_release=rank),
+        Stage("summarize", summarize, workers=1, queue_size=1),
+        Stage("post", post, workers=1, queue_size=1),
+    ], name="News run")
+    if posts_so_far[0] >= max_posts:
+        print("All posts of the interrupted run were already delivered.")
+    else:
+        print("Searching and assessing the relevance of the events...")
+        with SlackDeliveryQueue(digest_size=digest_size, log_file="news/slack_deliveries.jsonl") as slack:
+            news_pipeline.run()
+        # pyplot is not safe outside the main thread
+        plot_relevance_scores(list(scores.values()), relevance_threshold)
+
+    if not posts_so_far[0]:
+        print("No news posted on Slack.")
+    with open("news/slack_posts.json", "w") as json_file:
+        json.dump(slack_posts, json_file, indent=4)
+    fill_wikipedia_intros(all_concepts)
+    event_store.tier_events(lock=_store_lock)
+    if news_pipeline.failures:
+        # The journal is kept, so that the failed events are processed again with --resume
+        print(f"{news_pipeline.failures} items failed, run again with --resume to finish the run.")
+    else:
+        checkpoint.complete()
+
+
+def plot_relevance_scores(relevance_scores, relevance_threshold):
+    """
+    Plots the relevance scores on a bar plot with bins of 5, bar height being the count of events in that bin.
+    """
     # Create the bins
     if len(relevance_scores) > 10:
+        import numpy as np
+        import matplotlib.pyplot as plt
+
         bins = range(math.floor(min(relevance_scores)), math.ceil(max(relevance_scores)) + 5, 5)
 
         # Calculate the histogram
@@ -72,88 +258,76 @@ def search_and_post_on_slack(new_only=True, relevance_threshold=100, max_posts=5
         plt.savefig('news/relevance_scores.png')
         print('Figure added to news/relevance_scores.png')
 
-    iter_events.sort(key=lambda x: scores[x["uri"]], reverse=True)
-    
-    final_events = []
-    for event in iter_events:
-        if event["uri"] not in [e["uri"] for e in final_events] and event["uri"] not in [e["uri"] for e in slack_posts]:
-            final_events.append(event)
-    final_events.sort(key=lambda x: scores[x["uri"]], reverse=True)
-    
-    print("Summarizing content and posting on Slack...")
-    posts_so_far = 0
-    for event in final_events:
-        if scores[event["uri"]] < relevance_threshold:
-            continue
-        if posts_so_far >= max_posts:
-            break
-        title = event["title"] if isinstance(event.get("title"), str) else event["title"].get("eng", "No title available")
-        event, is_important = novel_summary(event, slack_posts)
-        event = save_event(event, update=True)
-        if not is_important:
-            say(f"The news article '{title}' is overlapping too much with the past content and was not posted.")
-            continue
 
-        top_concepts = [find_or_create_concept(concept_uri)[0] for concept_uri in event.get("concepts", [])]
-        top_concepts.sort(key=lambda x: x["relevance_score"], reverse=True)
-        top_concepts = top_concepts[:5]
-        article = event.get('stories', [])[0].get("medoidArticle") if event.get('stories', [])[0] else {}
-        block = {
-            "text": title,
-            "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*{title}*\n_{event.get('eventDate', '')}_"
-                    }
-                }, {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"{event['bullets']}"
-                    }
-                }, {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"_{', '.join([concept['name'] for concept in top_concepts])}_"
-                    }
-                }, {
-                    "type": "actions",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "Read more"
-                            },
-                            "style": "primary",
-                            "url": article.get("url", "")
-                        }
-                    ]
+def event_slack_block(event, score, all_concepts={}):
+    """
+    Builds the Slack message blocks for a summarized event.
+    """
+    title = event["title"] if isinstance(event.get("title"), str) else event["title"].get("eng", "No title available")
+    top_concepts = [find_or_create_concept(concept_uri, all_concepts)[0] for concept_uri in event.get("concepts", [])]
+    top_concepts = [concept for concept in top_concepts if concept.get("name")]
+    top_concepts.sort(key=lambda x: x.get("relevance_score", 0), reverse=True)
+    top_concepts = top_concepts[:5]
+    article = event.get('stories', [])[0].get("medoidArticle") if event.get('stories', [])[0] else {}
+    block = {
+        "text": title,
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*{title}*\n_{event.get('eventDate', '')}_"
                 }
-            ]
-        }
-        if article.get("image"):
-            block["blocks"][1]["accessory"] = {
-                "type": "image",
-                "image_url": article.get("image", ""),
-                "alt_text": f"Relevance: {int(scores.get(event['uri'], 0))}: {int(event["concept_relevance_score"])} & {int(event['ai_relevance_score'])}"
+            }, {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"{event['bullets']}"
+                }
+            }, {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"_{', '.join([concept['name'] for concept in top_concepts])}_"
+                }
+            }, {
+                "type": "actions",
+                "elements": [
+                    {
+                        "type": "button",
+                        "text": {
+                            "type": "plain_text",
+                            "text": "Read more"
+                        },
+                        "style": "primary",
+                        "url": article.get("url", "")
+                    }
+                ]
             }
-        if post_to_slack(block, True):
-            print(f"\n{event.get('eventDate', '')} - {title}")
-            slack_posts.append(event)
-            posts_so_far += 1
-    with open("news/slack_posts.json", "w") as json_file:
-        json.dump(slack_posts, json_file, indent=4)
+        ]
+    }
+    if article.get("image"):
+        block["blocks"][1]["accessory"] = {
+            "type": "image",
+            "image_url": article.get("image", ""),
+            "alt_text": f"Relevance: {int(score)}: {int(event["concept_relevance_score"])} & {int(event['ai_relevance_score'] or 0)}"
+        }
+    return block
 
 
-def novel_summary(post, previous_posts):
+def novel_summary(post, previous_posts, duplicate_index=None):
     title = post['title']['eng'] if isinstance(post['title'], dict) else post['title']
     concepts = post['concepts'] if isinstance(post['concepts'][0], str) else [p['uri'] for p in post["concepts"]]
     article = post.get('stories', [])[0].get("medoidArticle") if post.get('stories', [])[0] else {}
 
+    # Near-verbatim copies of past posts are rejected without asking the AI
+    if duplicate_index is not None and article.get("body"):
+        matches = duplicate_index.query(article["body"])
+        if matches:
+            post["duplicate_of"] = matches[0][0].split("#")[0]
+            say(f"'{title}' is a near-duplicate ({round(matches[0][1], 2)}) of {post['duplicate_of']}")
+            return post, False
+
     bullets = None
     is_important = True
     if len(post["concepts"]):
@@ -185,16 +359,33 @@ def novel_summary(post, previous_posts):
     return post, is_important
 
 
-def load_settings():
-    with open("news/news_settings.json", "r") as json_file:
-        settings = json.load(json_file)
-    return settings
+def build_duplicate_index(posts, threshold=None):
+    """
+    Indexes the article bodies and bullets of past posts for near-duplicate detection.
 
-def save_settings(key, new_value):
-    settings = load_settings()
-    settings[key] = new_value
-    with open("news/news_settings.json", "w") as json_file:
-        json.dump(settings, json_file, indent=4)
+    Args:
+        posts (list): The posted events.
+        threshold (float, optional): The estimated Jaccard similarity from which an article counts as a duplicate.
+            Defaults to the 'duplicate_threshold' setting.
+
+    Returns:
+        NearDuplicateIndex: The index.
+    """
+    from near_duplicates import NearDuplicateIndex
+
+    if threshold is None:
+        threshold = load_settings().get("duplicate_threshold", DUPLICATE_THRESHOLD)
+    index = NearDuplicateIndex(threshold=threshold)
+    for post in posts:
+        add_post_to_duplicate_index(index, post)
+    return index
+
+
+def add_post_to_duplicate_index(index, post):
+    stories = post.get('stories') or [None]
+    article = stories[0].get("medoidArticle", {}) if stories[0] else {}
+    index.add(f"{post['uri']}#body", article.get("body"))
+    index.add(f"{post['uri']}#bullets", post.get("bullets"))
 
 
 def find_or_create_concept(concept, all_concepts={}):
@@ -256,118 +447,153 @@ def find_or_create_concept(concept, all_concepts={}):
             concept["events"] = []
             concept["wiki"] = {}
             if "wikipedia.org" in concept["uri"]:
-                concept["wiki"]["shortly"] = fetch_wikipedia_intro_content(concept["uri"])
+                # The intro is downloaded in the background and added by fill_wikipedia_intros
+                prefetch_wikipedia_intro(concept["uri"])
             concept["category"] = translation[answer.get("category")]
         else:
             # Could not create a concept in the proper format
             return concept, all_concepts
     
-    all_concepts["concepts"][concept["uri"]] = concept
-    if concept["uri"] not in all_concepts["classification"][concept["category"]]:
-        all_concepts["classification"][concept["category"]].append(concept["uri"])
+    with _store_lock:
+        all_concepts["concepts"][concept["uri"]] = concept
+        if concept["uri"] not in all_concepts["classification"][concept["category"]]:
+            all_concepts["classification"][concept["category"]].append(concept["uri"])
 
-    if existing_concept:
-        print(f"Merged concept '{concept['name']}' ({concept.get("relevance_score", 0)}) to category '{concept['category']}'")
-    else:
-        print(f"Added concept '{concept['name']}' ({concept.get("relevance_score", 0)}) to category '{concept['category']}'")
+        if existing_concept:
+            print(f"Merged concept '{concept['name']}' ({concept.get("relevance_score", 0)}) to category '{concept['category']}'")
+        else:
+            print(f"Added concept '{concept['name']}' ({concept.get("relevance_score", 0)}) to category '{concept['category']}'")
 
-    with open("news/concepts.json", "w") as json_file:
-        json.dump(all_concepts, json_file, indent=4)
+        with open("news/concepts.json", "w") as json_file:
+            json.dump(all_concepts, json_file, indent=4)
     
     return concept, all_concepts
 
 
-def add_event_to_concept(concept, event):
+def add_event_to_concept(concept, event, all_concepts=None):
     if event["uri"] not in concept["events"]:
-        with open("news/concepts.json", "r") as json_file:
-            all_concepts = json.load(json_file)
-        if not all_concepts["concepts"].get(concept["uri"]):
-            concept, all_concepts = find_or_create_concept(concept, all_concepts)
-        if event["uri"] not in all_concepts["concepts"][concept["uri"]]:
-            all_concepts["concepts"][concept["uri"]]["events"].append(event["uri"])
-            with open("news/concepts.json", "w") as json_file:
-                json.dump(all_concepts, json_file, indent=4)
-            return True
+        with _store_lock:
+            if not all_concepts:
+                with open("news/concepts.json", "r") as json_file:
+                    all_concepts = json.load(json_file)
+            if not all_concepts["concepts"].get(concept["uri"]):
+                concept, all_concepts = find_or_create_concept(concept, all_concepts)
+            if event["uri"] not in all_concepts["concepts"][concept["uri"]]["events"]:
+                all_concepts["concepts"][concept["uri"]]["events"].append(event["uri"])
+                with open("news/concepts.json", "w") as json_file:
+                    json.dump(all_concepts, json_file, indent=4)
+                return True
     return False
 
 
 def add_event_to_category(category, event):
-    with open("news/categories.json", "r") as json_file:
-        categories = json.load(json_file)
-    for cat in categories:
-        if cat["uri"] == category["uri"]:
-            if cat["approved"]:
-                if not category.get("events"):
-                    category["events"] = []
-                if event["uri"] not in category["events"]:
-                    cat["events"].append(event["uri"])
-                    with open("news/categories.json", "w") as json_file:
-                        json.dump(categories, json_file, indent=4)
-                    return True
-            break
+    with _store_lock:
+        with open("news/categories.json", "r") as json_file:
+            categories = json.load(json_file)
+        for cat in categories:
+            if cat["uri"] == category["uri"]:
+                if cat["approved"]:
+                    if not category.get("events"):
+                        category["events"] = []
+                    if event["uri"] not in category["events"]:
+                        cat["events"].append(event["uri"])
+                        with open("news/categories.json", "w") as json_file:
+                            json.dump(categories, json_file, indent=4)
+                        return True
+                break
     return False
 
 
-def save_event(event, update=False):
-    with open("news/events.json", "r") as json_file:
-        events_data = json.load(json_file)
-    if not events_data.get(event["uri"]):
-        concept_uri_list = []
-        all_concepts = {}
-        for concept in event.get("concepts"):
-            saved_concept, all_concepts = find_or_create_concept(concept, all_concepts)
-            concept_uri_list.append(saved_concept["uri"])
-            if saved_concept["approved"] and event["uri"] not in saved_concept["events"]:
-                add_event_to_concept(saved_concept, event)
-        event["concepts"] = concept_uri_list
-
-        title = event['title'].get("eng")
-        if not title:
-            title = event['title'][list(event["title"].keys())[0]]
-            title = ask_ai(f"Please translate the following title to English: '{title}'. Please only provide the translation and nothing else.")
-            event['title']["eng"] = title
-        summary = event['summary'].get("eng")
-        if not summary:
-            summary = event['summary'][list(event["summary"].keys())[0]]
-            summary = ask_ai(f"Please translate the following summary to English: '{summary}'. Please only provide the translation and nothing else.")
-            event['summary']["eng"] = summary
-
-        for category in event.get("categories", []):
-            add_event_to_category(category, event)
-
-        events_data[event["uri"]] = event
-
-    elif update:
-        events_data[event["uri"]].update(event)
-    
-    with open("news/events.json", "w") as json_file:
-        json.dump(events_data, json_file, indent=4)
+def enrich_event(event, all_concepts=None):
+    """
+    Creates the concepts of a freshly fetched event, links the event to approved concepts and categories,
+    and translates its title and summary to English.
+
+    Args:
+        event (dict): The event as returned by the Event Registry API.
+        all_concepts (dict, optional): The contents of news/concepts.json. Loaded from the file if not given.
+
+    Returns:
+        dict: The event with its concepts replaced by their URIs.
+    """
+    concept_uri_list = []
+    all_concepts = all_concepts if all_concepts is not None else {}
+    for concept in event.get("concepts"):
+        saved_concept, all_concepts = find_or_create_concept(concept, all_concepts)
+        concept_uri_list.append(saved_concept["uri"])
+        if saved_concept.get("approved") and event["uri"] not in saved_concept["events"]:
+            add_event_to_concept(saved_concept, event, all_concepts)
+    event["concepts"] = concept_uri_list
+
+    title = event['title'].get("eng")
+    if not title:
+        title = event['title'][list(event["title"].keys())[0]]
+        title = ask_ai(f"Please translate the following title to English: '{title}'. Please only provide the translation and nothing else.")
+        event['title']["eng"] = title
+    summary = event['summary'].get("eng")
+    if not summary:
+        summary = event['summary'][list(event["summary"].keys())[0]]
+        summary = ask_ai(f"Please translate the following summary to English: '{summary}'. Please only provide the translation and nothing else.")
+        event['summary']["eng"] = summary
+
+    for category in event.get("categories", []):
+        add_event_to_category(category, event)
+    return event
+
+
+def save_event(event, update=False, enrich=True):
+    """
+    Saves the event to news/events.json. New events are enriched first unless enrich is False.
+    """
+    with _store_lock:
+        with open("news/events.json", "r") as json_file:
+            events_data = json.load(json_file)
+        is_new = not events_data.get(event["uri"])
+    if is_new and enrich:
+        event = enrich_event(event)
+
+    with _store_lock:
+        if is_new and enrich:
+            # Other workers may have saved events while this one was being enriched
+            with open("news/events.json", "r") as json_file:
+                events_data = json.load(json_file)
+        if is_new:
+            events_data[event["uri"]] = event
+        elif update:
+            events_data[event["uri"]].update(event)
+
+        if is_new or update:
+            with open("news/events.json", "w") as json_file:
+                json.dump(events_data, json_file, indent=4)
     
     return event
     
 
 def fetch_wikipedia_intro_content(url):
-    # Send a GET request to the Wikipedia article URL
-    response = requests.get(url)
+    return wiki_intros.get_service().fetch(url)
 
-    text = ""
-    if response.status_code == 200:
-        # Parse the HTML content of the page
-        soup = BeautifulSoup(response.content, 'html.parser')
-        # Find the first section of the article
-        content = soup.find('div', {'class': 'mw-content-ltr'})
-        if content is not None:
-            text = content.find('p', class_ = lambda value: value != 'mw-empty-elt').getText()
-    else:
-        print(f"Error: {response.status_code}:\n{response.text[:200]}")
-    text = re.sub(r'\[\d+\]', '', text)
-    return text
+
+def prefetch_wikipedia_intro(url):
+    wiki_intros.get_service().prefetch(url)
+
+
+def fill_wikipedia_intros(all_concepts=None):
+    """
+    Adds the missing Wikipedia intros of concepts and saves news/concepts.json if any were added.
+    """
+    with _store_lock:
+        if not all_concepts:
+            with open("news/concepts.json", "r") as json_file:
+                all_concepts = json.load(json_file)
+        if wiki_intros.fill_wikipedia_intros(all_concepts):
+            with open("news/concepts.json", "w") as json_file:
+                json.dump(all_concepts, json_file, indent=4)
     
 
-def measure_event_relevance(event):
+def measure_event_relevance(event, all_concepts=None):
     if not event.get("concept_relevance_score"):
         analyzed_concept_list = []
-        all_concepts = {}
+        all_concepts = all_concepts if all_concepts is not None else {}
         for concept in event["concepts"]:
             saved_concept, all_concepts = find_or_create_concept(concept, all_concepts)
             analyzed_concept_list.append(saved_concept)
@@ -396,19 +622,26 @@ def measure_event_relevance(event):
     return score, concept_relevance_score, ai_relevance_score
 
 
-def get_concept_uri(concept_label, tries=0):
+def get_concept_uri(concept_label, tries=0, local=True):
     """
-    This function retrieves the concept URI for a given concept label using the Event Registry API.
+    This function retrieves the concept URI for a given concept label. Labels and synonyms of known concepts
+    and earlier answers are resolved locally, and only misses are sent to the Event Registry API.
 
     Args:
     concept_label (str): The concept label to search for.
-    api_key (str): Your Event Registry API key.
+    local (bool): Whether to look up the label locally first. Defaults to True.
 
     Returns:
     str: The concept URI if found, otherwise None.
     """
     global API_KEY
 
+    resolver = concept_labels.get_resolver()
+    if local:
+        uri = resolver.resolve(concept_label)
+        if uri:
+            return uri
+
     url = "https://eventregistry.org/api/v1/suggestConceptsFast"
     data = {
         "prefix": concept_label,
@@ -420,15 +653,16 @@ def get_concept_uri(concept_label, tries=0):
     }
 
     # Send the request
-    response = requests.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(data))
+    response = requests.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(data), timeout=10)
     if response.status_code == 200:
         response_data = response.json()
         if len(response_data):
             if response_data[0].get("uri", ""):
+                resolver.add(concept_label, response_data[0]["uri"])
                 return response_data[0]["uri"]
             else:
                 if tries < 3:
-                    return get_concept_uri(concept_label, tries=tries + 1)
+                    return get_concept_uri(concept_label, tries=tries + 1, local=False)
                 else:
                     print(f"Error: Concept URI not found for '{concept_label}'")
                     return None
@@ -438,22 +672,40 @@ def get_concept_uri(concept_label, tries=0):
     return None
 
 
-def search_latest_events(force_search=False):
+def get_concept_uris(concept_labels_list):
+    """
+    Resolves many concept labels at once. Local hits are returned right away and only the misses are sent to the API.
+
+    Returns:
+        dict: The concept URI (or None) by label.
+    """
+    resolver = concept_labels.get_resolver()
+    uris = {label: resolver.resolve(label) for label in concept_labels_list}
+    misses = [label for label, uri in uris.items() if not uri]
+    say(f"Resolved {len(uris) - len(misses)}/{len(uris)} concept labels locally.")
+    for label in misses:
+        uris[label] = get_concept_uri(label, local=False)
+    return uris
+
+
+def search_latest_events(force_search=False, save=True, on_events=None):
     print("Searching for latest events...")
     with open("news/concepts.json", "r") as json_file:
         concepts = json.load(json_file)
 
     relevant_concepts = [concept["uri"] for concept in concepts["concepts"].values() if concept.get("approved", False)]
-    return events_search(relevant_concepts, force_search=force_search)
+    return events_search(relevant_concepts, force_search=force_search, save=save, on_events=on_events)
     
 
 
-def events_search(concept_uris, days_before_today=None, force_search=False):
+def events_search(concept_uris, days_before_today=None, force_search=False, save=True, on_events=None):
     """
     Finds the date when the events were last searched for these URIs, searches for events since that date, and saves the events to a JSON file.
 
     Args:
         concept_uris (list): List of the URIs of the concepts to search for events.
+        save (bool, optional): Whether to save and enrich the found events right away. Defaults to True.
+        on_events (function, optional): Called with the events of every page as soon as the page has been fetched.
 
     Returns:
         tuple: A tuple containing two lists. The first list contains all the events found for the given concept URIs, including the ones that were already saved in the JSON file. The second list contains only the new events found in the search.
@@ -530,14 +782,18 @@ def events_search(concept_uris, days_before_today=None, force_search=False):
             concept_uris,
             start_date=search_start_date,
             end_date=search_end_date,
-            exclude_event_uris=existing_preceding_events)
+            exclude_event_uris=existing_preceding_events,
+            save=save,
+            on_events=on_events)
         post_events = find_all_events_by_concepts(
                 concept_uris,
                 start_date=last_search_date,
-                exclude_event_uris=existing_later_events)
+                exclude_event_uris=existing_later_events,
+                save=save,
+                on_events=on_events)
         new_events += pre_events + post_events
     else:
-        new_events += find_all_events_by_concepts(concept_uris, start_date=search_start_date, end_date=search_end_date, exclude_event_uris=existing_later_events)
+        new_events += find_all_events_by_concepts(concept_uris, start_date=search_start_date, end_date=search_end_date, exclude_event_uris=existing_later_events, save=save, on_events=on_events)
 
 
     # Filter out potential duplicates
@@ -572,7 +828,7 @@ def events_search(concept_uris, days_before_today=None, force_search=False):
 
 
 
-def find_all_events_by_concepts(concept_uris, page=False, start_date=None, end_date=None, exclude_event_uris=[], use_categories=True, debug=False, tries=0):
+def find_all_events_by_concepts(concept_uris, page=False, start_date=None, end_date=None, exclude_event_uris=[], use_categories=True, debug=False, tries=0, save=True, on_events=None):
     """
     Find all events from the past 31 days or from the given range for a given concept URI.
 
@@ -581,6 +837,8 @@ def find_all_events_by_concepts(concept_uris, page=False, start_date=None, end_d
         page (bool, optional): Whether to retrieve events from a specific page. Defaults to False.
         start_date (datetime.date, optional): The start date to filter events. Defaults to None, and the past 31 days are searched.
         end_date (datetime.date, optional): The end date to filter events. Defaults to None and is ignored if start_date is None. When None, the current date is used.
+        save (bool, optional): Whether to save and enrich the found events right away. Defaults to True.
+        on_events (function, optional): Called with the events of every page as soon as the page has been fetched.
 
     Returns:
         list: A list of dictionaries containing event information.
@@ -671,12 +929,15 @@ def find_all_events_by_concepts(concept_uris, page=False, start_date=None, end_d
     if response.status_code == 200:
         data = response.json()
         events = [event for event in data.get("events", {}).get("results", [])]
-        for event in events:
-            event = save_event(event)
+        if save:
+            for event in events:
+                event = save_event(event)
+        if on_events:
+            on_events(events)
                 
         if not page and data.get("events", {}).get("pages", 0) > 1:
             for page in range(2, data["events"]["pages"] + 1):
-                events += find_all_events_by_concepts(concept_uris, page=page)
+                events += find_all_events_by_concepts(concept_uris, page=page, save=save, on_events=on_events)
         say(f"Found {len(events)} events for {len(concept_uris)} concepts.")
         return events
     elif response.status_code == 414:
@@ -684,8 +945,8 @@ def find_all_events_by_concepts(concept_uris, page=False, start_date=None, end_d
             split_point = int(len(concept_uris)/2)
             # TODO: assign exclude event uris to the right halves
             events = []
-            events += find_all_events_by_concepts(concept_uris[:split_point], page=page, start_date=start_date, end_date=end_date, exclude_event_uris=exclude_event_uris, use_categories=use_categories, debug=debug, tries=tries + 1)
-            events += find_all_events_by_concepts(concept_uris[split_point:], page=page, start_date=start_date, end_date=end_date, exclude_event_uris=exclude_event_uris, use_categories=use_categories, debug=debug, tries=tries + 1)
+            events += find_all_events_by_concepts(concept_uris[:split_point], page=page, start_date=start_date, end_date=end_date, exclude_event_uris=exclude_event_uris, use_categories=use_categories, debug=debug, tries=tries + 1, save=save, on_events=on_events)
+            events += find_all_events_by_concepts(concept_uris[split_point:], page=page, start_date=start_date, end_date=end_date, exclude_event_uris=exclude_event_uris, use_categories=use_categories, debug=debug, tries=tries + 1, save=save, on_events=on_events)
             
             say(f"Found {len(events)} events for {len(concept_uris)} concepts.")
             return events
@@ -700,5 +961,8 @@ def find_all_events_by_concepts(concept_uris, page=False, start_date=None, end_d
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search for the latest news and post the most relevant ones on Slack.")
+    parser.add_argument("--resume", action="store_true", help="continue the interrupted previous run")
+    args = parser.parse_args()
     os.chdir("/Users/vinkoo/code/ie_research_map")
-    search_and_post_on_slack(relevance_threshold=90)
+    search_and_post_on_slack(relevance_threshold=90, resume=args.resume)
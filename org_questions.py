@@ -0,0 +1,507 @@
+import ast
+import concurrent.futures
+import json
+import re
+
+from ai_apis import ask_ai
+from utils import save_profiles
+
+# Number of organizations asked about in one prompt
+BATCH_SIZE = 10
+
+INSTRUCTIONS = {
+    "integer": "Please provide an integer value as the answer and nothing else.",
+    "string": "Please provide an answer without any additional information (e.g. <here's the answer>).",
+    "float": "Please provide a float value as the answer and nothing else.",
+    "boolean": "Please provide a boolean value (True or False) as the answer and nothing else",
+    "list": "Please provide a JSON list as the answer and nothing else.",
+    "dictionary": "Please provide a JSON dictionary value as the answer and nothing else."
+}
+
+# How the answers of each type are written in a JSON answer
+JSON_TYPES = {
+    "integer": "a JSON integer",
+    "string": "a short JSON string",
+    "float": "a JSON number",
+    "boolean": "a JSON boolean (true or false)",
+    "list": "a JSON list",
+    "dictionary": "a JSON object"
+}
+
+
+NUMBER = re.compile(r"(?<![\w.,-])-?\d+(?:[.,]\d+)*")
+# Any run of digits and separators, so that ranges such as '10-20' count as two numbers
+DIGITS = re.compile(r"\d+(?:[.,]\d+)*")
+MULTIPLIERS = {"thousand": 1e3, "million": 1e6, "billion": 1e9}
+TRUE_WORDS = {"true", "yes"}
+FALSE_WORDS = {"false", "no"}
+BULLET = re.compile(r"^\s*(?:[-*\u2022]|\d+[.)])\s+")
+
+
+def normalize_type(property_type):
+    """
+    Returns the property type in the form of the INSTRUCTIONS keys, e.g. 'integer' for 'Integer.'.
+    """
+    property_type = (property_type or "").strip().strip(".'\"").lower()
+    return property_type if property_type in INSTRUCTIONS else "string"
+
+
+def answer_instruction(property_type):
+    return INSTRUCTIONS[normalize_type(property_type)]
+
+
+def _strip_answer(text):
+    """
+    Removes code fences, quotes and a leading 'Answer:' around a plain text answer.
+    """
+    text = text.strip()
+    fence = re.match(r"^```[\w-]*\s*(.*?)\s*```$", text, re.S)
+    if fence:
+        text = fence.group(1)
+    text = re.sub(r"^answer\s*:\s*", "", text.strip(), flags=re.I)
+    return text.strip().strip("\"'`").strip()
+
+
+def _parse_number(text):
+    """
+    Returns the number in the text, e.g. 1200.0 for 'approximately 1,200 staff' or 2500000.0 for
+    '2.5 million', or None if there is none or several, as in 'In 2019, about 1,200 staff' or '10-20'.
+    Numbers glued to letters such as '5th' and ambiguous ones such as '1.000' are not accepted either.
+    """
+    matches = list(NUMBER.finditer(text))
+    if len(matches) != 1 or len(DIGITS.findall(text)) != 1:
+        return None
+    match = matches[0]
+    if re.match(r"[^\W\d_]", text[match.end():]):
+        return None
+    number = match.group()
+    if re.fullmatch(r"-?\d{1,3}(,\d{3})+(\.\d+)?", number):
+        number = number.replace(",", "")
+    elif re.fullmatch(r"-?\d{1,3}(\.\d{3}){2,}(,\d+)?|-?\d{1,3}\.\d{3},\d+", number):
+        # Dots as thousands separators, e.g. 1.000.000 or 1.000,5
+        number = number.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"-?[1-9]\d{0,2}\.\d{3}", number):
+        # A thousand or a decimal, e.g. 1.000
+        return None
+    elif re.fullmatch(r"-?\d+,\d+", number):
+        # A decimal comma
+        number = number.replace(",", ".")
+    elif not re.fullmatch(r"-?\d+(\.\d+)?", number):
+        return None
+    value = float(number)
+    scale = re.match(r"\s*(thousand|million|billion)\b", text[match.end():], re.I)
+    if scale:
+        value *= MULTIPLIERS[scale.group(1).lower()]
+    return value
+
+
+def _parse_boolean(text):
+    """
+    Returns True or False for an answer starting with yes/no or true/false, or None otherwise, also when it
+    starts with a number such as '10 employees'.
+    """
+    words = re.findall(r"[a-z]+|\d+", text.lower())
+    if words and words[0] in TRUE_WORDS:
+        return True
+    if words and words[0] in FALSE_WORDS:
+        return False
+    return None
+
+
+def _parse_embedded_json(text, expected_type):
+    """
+    Parses the text, or the first bracketed part of it, as JSON or as a Python literal of the expected type.
+    """
+    opening, closing = ("[", "]") if expected_type is list else ("{", "}")
+    candidates = [text]
+    start, end = text.find(opening), text.rfind(closing)
+    if start != -1 and end > start:
+        candidates.append(text[start:end + 1])
+    for candidate in candidates:
+        for loads in [json.loads, ast.literal_eval]:
+            try:
+                value = loads(candidate)
+            except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+                continue
+            if isinstance(value, expected_type):
+                return value
+    if expected_type is list:
+        # A bulleted or numbered list
+        lines = [line for line in text.splitlines() if line.strip()]
+        if lines and all(BULLET.match(line) for line in lines):
+            return [BULLET.sub("", line).strip() for line in lines]
+    return None
+
+
+def parse_answer(answer, property_type):
+    """
+    Converts an answer to the property type, tolerating the ways language models dress up their answers:
+    numbers inside sentences or with thousands separators, yes/no for booleans, JSON inside code fences or
+    prose and Python literals. Both plain text answers and values from a JSON answer are accepted.
+
+    Returns:
+        tuple: Whether the answer could be converted and the converted value.
+    """
+    property_type = normalize_type(property_type)
+    if answer is None:
+        return False, None
+    if isinstance(answer, str):
+        text = _strip_answer(answer)
+        if not text:
+            return False, None
+        if property_type in ["integer", "float"]:
+            value = _parse_number(text)
+        elif property_type == "boolean":
+            value = _parse_boolean(text)
+        elif property_type in ["list", "dictionary"]:
+            value = _parse_embedded_json(text, list if property_type == "list" else dict)
+        else:
+            return True, text
+        if value is None:
+            return False, None
+    else:
+        value = answer
+    if property_type == "integer":
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False, None
+        return True, int(round(value))
+    elif property_type == "float":
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False, None
+        return True, float(value)
+    elif property_type == "boolean":
+        return isinstance(value, bool), value if isinstance(value, bool) else None
+    elif property_type == "list":
+        return isinstance(value, list), value if isinstance(value, list) else None
+    elif property_type == "dictionary":
+        return isinstance(value, dict), value if isinstance(value, dict) else None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return True, str(value)
+    return False, None
+
+
+class AnswerStats:
+    """
+    Counts the answers asked for and the answers that could be parsed, per property type and per stage
+    of answer_question: the first batched ask, the strict batched re-ask and the single asks.
+    """
+
+    STAGES = ["batch", "strict", "single"]
+
+    def __init__(self):
+        self.counts = {}
+
+    def record(self, property_type, stage, outcome):
+        """
+        Records one answer. The outcome is 'parsed', 'unknown' for an explicit null or 'failed'.
+        """
+        counts = self.counts.setdefault(normalize_type(property_type), {}).setdefault(stage, {"asked": 0, "parsed": 0, "unknown": 0, "failed": 0})
+        counts["asked"] += 1
+        counts[outcome] += 1
+
+    def success_rate(self, property_type, stage="batch"):
+        counts = self.counts.get(normalize_type(property_type), {}).get(stage)
+        if not counts or not counts["asked"]:
+            return None
+        return counts["parsed"] / counts["asked"]
+
+    def report(self):
+        for property_type, stages in self.counts.items():
+            parts = []
+            for stage in self.STAGES:
+                if stage in stages:
+                    counts = stages[stage]
+                    part = f"{stage} {counts['parsed']}/{counts['asked']} ({counts['parsed'] / counts['asked']:.0%})"
+                    if counts["unknown"]:
+                        part += f", {counts['unknown']} unknown"
+                    parts.append(part)
+            print(f"{property_type} answers parsed: " + "; ".join(parts))
+
+
+def ask_an_organization(organization_name, q, instruction, property_name, property_type, profile, savefile=None):
+    """
+    Asks the question about one organization and stores the answer in its profile.
+
+    Returns:
+        The answer, or None if the organization was already answered or no answer could be parsed.
+        Unparsed answers are not stored, so the organization stays unanswered.
+    """
+    if property_name in profile:
+        return None
+    answer = ask_ai(f"I would like to know something about an organization called {organization_name} with context of improving child and adolescent health in developing countries. Please give a conscise answer to question: {q.replace('?','')}? {instruction}")
+    ok, value = parse_answer(answer, property_type)
+    if not ok:
+        print(f"{organization_name}: could not read the answer {answer!r}")
+        return None
+    profile[property_name] = value
+    print(f"{organization_name}: {profile[property_name]}")
+    if savefile:
+        save_profiles(savefile, {organization_name: profile})
+    return profile[property_name]
+
+
+def ask_organizations(organization_names, q, property_name, property_type, strict=False):
+    """
+    Asks the question about several organizations in one JSON-mode prompt.
+
+    With strict, the prompt insists on bare JSON values and allows null for an unknown answer, for
+    re-asking the organizations whose earlier answers could not be parsed.
+
+    Returns:
+        dict: The parsed answers by organization name, with None for the explicit nulls of a strict prompt.
+        Organizations with a missing or unparsed answer are left out.
+    """
+    property_type = normalize_type(property_type)
+    organization_list = "\n".join(f"- {organization_name}" for organization_name in organization_names)
+    instructions = f"Answer in JSON format with the key 'answers' containing a dictionary that maps each organization name exactly as written below to its answer, which must be {JSON_TYPES[property_type]}."
+    if strict:
+        instructions += " Earlier answers to this question could not be read, so give every answer as a bare JSON value without units, words or explanations, and use null if the answer is not known."
+    response = ask_ai(
+        f"I would like to know something about the organizations listed below with context of improving child and adolescent health in developing countries. Please give a conscise answer to question: {q.replace('?','')}? for each organization. {instructions}\nOrganizations:\n{organization_list}",
+        json_mode=True)
+    try:
+        answers = json.loads(response)["answers"] if response else {}
+    except (ValueError, KeyError, TypeError):
+        answers = {}
+    if not isinstance(answers, dict):
+        answers = {}
+    parsed = {}
+    for organization_name in organization_names:
+        if strict and organization_name in answers and answers[organization_name] is None:
+            parsed[organization_name] = None
+            continue
+        ok, value = parse_answer(answers.get(organization_name), property_type)
+        if ok:
+            parsed[organization_name] = value
+    return parsed
+
+
+class QuestionCoverage:
+    """
+    Registry of the asked questions and a sparse coverage matrix of organizations × questions.
+
+    For every question the set of organizations that have not answered it is kept and updated as answers
+    are recorded, so the unanswered questions and the organizations missing an answer are looked up
+    without scanning the profiles. The savefile keeps the matrix in its 'coverage' key, which
+    utils.save_profile and utils.save_profiles update through update_coverage.
+
+    Usage:
+        coverage = QuestionCoverage.from_json(load_coverage(savefile))
+        for question in coverage.unanswered_questions():
+            print(question[0], len(coverage.missing(question[1])))
+    """
+
+    def __init__(self, questions=(), profiles=None):
+        self.questions = {}
+        self.unanswered = {}
+        # The questions that some organization has not answered yet
+        self.incomplete = set()
+        self.organizations = set()
+        profiles = {name: profile for name, profile in (profiles or {}).items() if profile}
+        for question in questions:
+            self.add_question(question)
+        for profile in profiles.values():
+            # Questions that were only recorded in the profiles
+            for question in profile.get("questions", []):
+                self.add_question(question)
+        for organization_name, profile in profiles.items():
+            self.add_organization(organization_name, profile)
+
+    @classmethod
+    def from_json(cls, coverage):
+        """
+        Creates the coverage from the one kept in the savefile, see to_json and utils.load_coverage.
+        """
+        instance = cls()
+        instance.organizations = set(coverage["organizations"])
+        for question in coverage["questions"]:
+            question = tuple(question)
+            instance.questions[question[1]] = question
+            instance.unanswered[question[1]] = set(coverage["unanswered"].get(question[1], []))
+            if instance.unanswered[question[1]]:
+                instance.incomplete.add(question[1])
+        return instance
+
+    def to_json(self):
+        return {
+            "questions": [list(question) for question in self.questions.values()],
+            "organizations": sorted(self.organizations),
+            "unanswered": {property_name: sorted(names) for property_name, names in self.unanswered.items() if names}
+        }
+
+    @staticmethod
+    def answered(profile, question):
+        return question[1] in profile or question[0] in set(listed[0] for listed in profile.get("questions", []))
+
+    def add_question(self, question, profiles=None):
+        """
+        Registers a question given as (question, property_name, property_type). Without the profiles, no
+        organization is taken to have answered it yet.
+        """
+        question = tuple(question)
+        property_name = question[1]
+        if property_name in self.questions:
+            return
+        self.questions[property_name] = question
+        if profiles is None:
+            self.unanswered[property_name] = set(self.organizations)
+        else:
+            self.unanswered[property_name] = set(name for name in self.organizations if profiles.get(name) and not self.answered(profiles[name], question))
+        if self.unanswered[property_name]:
+            self.incomplete.add(property_name)
+
+    def add_organization(self, organization_name, profile):
+        """
+        Adds the organization or updates it from its saved profile.
+        """
+        self.organizations.add(organization_name)
+        for property_name, question in self.questions.items():
+            if self.answered(profile, question):
+                self.record(organization_name, property_name)
+            else:
+                self.unanswered[property_name].add(organization_name)
+                self.incomplete.add(property_name)
+
+    def remove_organization(self, organization_name):
+        self.organizations.discard(organization_name)
+        for property_name in self.questions:
+            self.record(organization_name, property_name)
+
+    def record(self, organization_name, property_name):
+        """
+        Marks the question as answered for the organization.
+        """
+        self.unanswered[property_name].discard(organization_name)
+        if not self.unanswered[property_name]:
+            self.incomplete.discard(property_name)
+
+    def missing(self, property_name):
+        """
+        Returns the organizations that have not answered the question.
+        """
+        return self.unanswered.get(property_name, set())
+
+    def unanswered_questions(self):
+        """
+        Returns the questions that some organization has not answered, in the order they were registered.
+        """
+        order = {property_name: index for index, property_name in enumerate(self.questions)}
+        return [self.questions[property_name] for property_name in sorted(self.incomplete, key=order.get)]
+
+
+def update_coverage(data, organization_names=None):
+    """
+    Updates the coverage kept in the savefile after the given profiles changed, registering the new questions
+    of the savefile and of those profiles. The coverage is built from all profiles if organization_names is None
+    or the savefile has none yet.
+
+    Args:
+        data (dict): The contents of the savefile, updated in place.
+        organization_names (list, optional): The organizations whose profiles changed.
+    """
+    profiles = data["profiles"]
+    if organization_names is None or "organizations" not in data.get("coverage", {}):
+        data["coverage"] = QuestionCoverage(data["questions"], profiles).to_json()
+        return
+    coverage = QuestionCoverage.from_json(data["coverage"])
+    for question in data["questions"]:
+        coverage.add_question(question, profiles)
+    for organization_name in organization_names:
+        profile = profiles.get(organization_name)
+        for question in (profile or {}).get("questions", []):
+            coverage.add_question(question, profiles)
+        if profile:
+            coverage.add_organization(organization_name, profile)
+        else:
+            coverage.remove_organization(organization_name)
+    data["coverage"] = coverage.to_json()
+
+
+def answer_question(profiles, q, property_name, property_type, savefile, batch_size=BATCH_SIZE, workers=5, coverage=None, stats=None):
+    """
+    Answers the question for every profile that has no answer yet, several organizations per prompt.
+
+    The profiles are read from the given snapshot instead of reloading the savefile, and the answers of
+    each batch are saved together. Organizations missing from a batch answer or with an answer that could
+    not be parsed are queued and asked again in batches with a stricter prompt, which may also answer
+    null for unknown. Only the organizations still left after that are asked one at a time. The parsing
+    success rates of each stage are printed at the end.
+
+    Args:
+        profiles (dict): The profiles by organization name, updated in place.
+        q (str): The question.
+        property_name (str): The profile property that holds the answer.
+        property_type (str): The type of the answer, e.g. 'integer' or 'list'.
+        savefile (str): The savefile of the profiles.
+        batch_size (int, optional): The number of organizations per prompt. Defaults to BATCH_SIZE.
+        workers (int, optional): The number of prompts sent at the same time. Defaults to 5.
+        coverage (QuestionCoverage, optional): The coverage matrix to take the unanswered organizations from and to record the answers in.
+        stats (AnswerStats, optional): Where to count the parsed answers. Defaults to new counts for this question.
+
+    Returns:
+        int: The number of organizations that got an answer.
+    """
+    property_type = normalize_type(property_type)
+    instruction = answer_instruction(property_type)
+    stats = stats if stats is not None else AnswerStats()
+    if coverage is not None:
+        missing = sorted(coverage.missing(property_name))
+    else:
+        missing = [organization_name for organization_name, profile in profiles.items() if profile and property_name not in profile]
+    answered = 0
+
+    def ask_batch(batch, strict):
+        # A failed prompt only fails its own batch, which is then asked again
+        try:
+            return ask_organizations(batch, q, property_name, property_type, strict)
+        except Exception as e:
+            print(f"Asking about {', '.join(batch)} failed: {e}")
+            return {}
+
+    def ask_one(organization_name):
+        try:
+            return ask_an_organization(organization_name, q, instruction, property_name, property_type, profiles[organization_name], savefile)
+        except Exception as e:
+            print(f"Asking about {organization_name} failed: {e}")
+            return None
+
+    def store(organization_name, value):
+        profiles[organization_name][property_name] = value
+        if coverage is not None:
+            coverage.record(organization_name, property_name)
+        print(f"{organization_name}: {value}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        failed = missing
+        for stage in ["batch", "strict"]:
+            if stage == "strict" and failed:
+                print(f"Asking {len(failed)} organizations again with a stricter prompt")
+            batches = [failed[i:i + batch_size] for i in range(0, len(failed), batch_size)]
+            failed = []
+            results = executor.map(lambda batch, strict=stage == "strict": ask_batch(batch, strict), batches)
+            for batch, answers in zip(batches, results):
+                for organization_name in batch:
+                    if organization_name not in answers:
+                        stats.record(property_type, stage, "failed")
+                        failed.append(organization_name)
+                        continue
+                    stats.record(property_type, stage, "parsed" if answers[organization_name] is not None else "unknown")
+                    store(organization_name, answers[organization_name])
+                if answers:
+                    save_profiles(savefile, {organization_name: profiles[organization_name] for organization_name in answers})
+                answered += len(answers)
+
+        if failed:
+            print(f"Asking {len(failed)} organizations again one at a time")
+        results = executor.map(ask_one, failed)
+        for organization_name, result in zip(failed, results):
+            if property_name in profiles[organization_name]:
+                stats.record(property_type, "single", "parsed")
+                answered += 1
+                if coverage is not None:
+                    coverage.record(organization_name, property_name)
+            else:
+                stats.record(property_type, "single", "failed")
+    if missing:
+        stats.report()
+    return answered
@@ -0,0 +1,151 @@
+import concurrent.futures
+from html.parser import HTMLParser
+import re
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import get_cache
+from utils import say
+
+TIMEOUT = (5, 10)
+# Stop reading a page after this many bytes, the text worth summarizing comes early
+MAX_BYTES = 1024 * 1024
+# Token budget of the combined text, estimated from its length
+MAX_TOKENS = 6000
+CHARACTERS_PER_TOKEN = 4
+# Shorter paragraphs are mostly menu entries, buttons and captions
+MIN_PARAGRAPH_LENGTH = 40
+SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "nav", "header", "footer", "aside", "form", "iframe"}
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "table", "tr", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "br", "dd", "dt"}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the pooled HTTP session shared by the page downloads of this process.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers["User-Agent"] = "Mozilla/5.0 (compatible; ie_research_map)"
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=1)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+
+class ParagraphParser(HTMLParser):
+    """
+    Streaming parser that collects the visible text of a page as paragraphs split at block elements,
+    leaving out scripts, styles, navigation, headers, footers and forms.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skip_depth = 0
+        self.paragraphs = []
+        self.parts = []
+
+    def _end_paragraph(self):
+        text = re.sub(r"\s+", " ", "".join(self.parts)).strip()
+        if text:
+            self.paragraphs.append(text)
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._end_paragraph()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._end_paragraph()
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._end_paragraph()
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def close(self):
+        super().close()
+        self._end_paragraph()
+
+
+def download_page(url, max_bytes=MAX_BYTES, timeout=TIMEOUT):
+    """
+    Downloads at most max_bytes of an HTML page through the HTTP cache.
+
+    Returns:
+        str: The HTML, or an empty string if the download failed or the page is not HTML.
+    """
+    response = get_cache().get(url, session=get_session(), max_bytes=max_bytes, timeout=timeout)
+    if response is None:
+        return ""
+    if response.status_code != 200:
+        say(f"{url} responded {response.status_code}")
+        return ""
+    if "html" not in response.headers.get("Content-Type", "text/html"):
+        say(f"Skipping {url}, not an HTML page")
+        return ""
+    return response.text
+
+
+def extract_paragraphs(html):
+    parser = ParagraphParser()
+    parser.feed(html)
+    parser.close()
+    return parser.paragraphs
+
+
+def extract_text(urls, max_tokens=MAX_TOKENS, workers=8, slots=None, download=download_page):
+    """
+    Downloads the pages concurrently and combines their visible text into clean text under a token budget.
+
+    Paragraphs are taken in page order, short fragments are dropped and paragraphs that already appeared
+    on an earlier page are left out, so boilerplate repeated across a site is included only once.
+
+    Args:
+        urls (list): The URLs of the pages.
+        max_tokens (int, optional): The token budget of the text. Defaults to MAX_TOKENS.
+        workers (int, optional): The number of pages downloaded at the same time. Defaults to 8.
+        slots (threading.Semaphore, optional): A limit on the downloads shared with other callers.
+        download (function, optional): Returns the HTML of a URL. Defaults to download_page.
+
+    Returns:
+        str: The text of the pages, one paragraph per line.
+    """
+    def fetch(url):
+        if slots is None:
+            return download(url)
+        with slots:
+            return download(url)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as executor:
+        pages = list(executor.map(fetch, urls))
+
+    seen = set()
+    lines = []
+    budget = max_tokens * CHARACTERS_PER_TOKEN
+    for html in pages:
+        for paragraph in extract_paragraphs(html):
+            key = paragraph.lower()
+            if len(paragraph) < MIN_PARAGRAPH_LENGTH or key in seen:
+                continue
+            seen.add(key)
+            if len(paragraph) + 1 > budget:
+                lines.append(paragraph[:budget])
+                return "\n".join(lines)
+            lines.append(paragraph)
+            budget -= len(paragraph) + 1
+    return "\n".join(lines)
@@ -0,0 +1,186 @@
+import queue
+import threading
+import time
+
+from utils import say
+
+_DONE = object()
+
+
+class Stage:
+    """
+    A pipeline stage with its own pool of worker threads.
+
+    The function receives one item and returns the item for the next stage, or None to drop it.
+    Every stage reads from a bounded queue, so a slow stage makes the stages before it wait
+    instead of piling up work in memory.
+    """
+
+    def __init__(self, name, function, workers=1, queue_size=16):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue_size = queue_size
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self._lock = threading.Lock()
+        self._running = 0
+
+    def run(self, pipeline, in_queue, out_queue):
+        self._running = self.workers
+        return [threading.Thread(target=self._work, args=(pipeline, in_queue, out_queue), name=f"{self.name}-{i}", daemon=True) for i in range(self.workers)]
+
+    def _work(self, pipeline, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                # Let the sibling workers see the end of the input too
+                in_queue.put(_DONE)
+                with self._lock:
+                    self._running -= 1
+                    last = self._running == 0
+                if last:
+                    out_queue.put(_DONE)
+                return
+            if pipeline.stopped.is_set():
+                continue
+            start = time.time()
+            try:
+                result = self.function(item)
+            except Exception as e:
+                print(f"Pipeline stage '{self.name}' failed: {e}")
+                result = None
+                with self._lock:
+                    self.failed += 1
+            with self._lock:
+                self.busy_time += time.time() - start
+                self.processed += 1
+                if result is None:
+                    self.dropped += 1
+            if result is not None:
+                out_queue.put(result)
+
+
+class Gate:
+    """
+    Collects every item from the previous stage and releases them best first once the previous stage is done.
+
+    Only items that pass the condition are released, and at most top_k of them. The callback on_release
+    receives all collected items before they are sorted, e.g. to score them together or for statistics.
+    """
+
+    def __init__(self, name, key, top_k=None, condition=None, on_release=None, queue_size=16):
+        self.name = name
+        self.key = key
+        self.top_k = top_k
+        self.condition = condition
+        self.on_release = on_release
+        self.queue_size = queue_size
+        self.workers = 1
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_time = 0.0
+
+    def run(self, pipeline, in_queue, out_queue):
+        return [threading.Thread(target=self._work, args=(pipeline, in_queue, out_queue), name=self.name, daemon=True)]
+
+    def _work(self, pipeline, in_queue, out_queue):
+        items = []
+        try:
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    break
+                items.append(item)
+            self.processed = len(items)
+            if self.on_release:
+                self.on_release(items)
+            items.sort(key=self.key, reverse=True)
+            released = [item for item in items if not self.condition or self.condition(item)]
+            if self.top_k is not None:
+                released = released[:self.top_k]
+            self.dropped = len(items) - len(released)
+            for item in released:
+                if pipeline.stopped.is_set():
+                    break
+                out_queue.put(item)
+        except Exception as e:
+            print(f"Pipeline gate '{self.name}' failed: {e}")
+            self.failed += 1
+        finally:
+            # The next stages wait for the end of the input even if the gate failed
+            out_queue.put(_DONE)
+
+
+class Pipeline:
+    """
+    Connects a source and a list of stages with bounded queues and runs them all at the same time.
+
+    The source is a function that receives an emit function and calls it for every item. Emit blocks
+    while the first stage is busy and returns False once the pipeline has been stopped.
+    """
+
+    def __init__(self, source, stages, name="pipeline"):
+        self.source = source
+        self.stages = stages
+        self.name = name
+        self.stopped = threading.Event()
+        self.results = []
+        self.source_failed = False
+
+    @property
+    def failures(self):
+        """
+        The number of items that failed in the stages, plus one if the source failed.
+        """
+        return sum(stage.failed for stage in self.stages) + int(self.source_failed)
+
+    def stop(self):
+        """
+        Stops feeding new items. Items already in the queues are drained without processing.
+        """
+        self.stopped.set()
+
+    def run(self):
+        """
+        Runs the pipeline until every stage has finished and returns the items that came out of the last stage.
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages] + [queue.Queue()]
+
+        def emit(item):
+            if self.stopped.is_set():
+                return False
+            queues[0].put(item)
+            return True
+
+        def produce():
+            try:
+                self.source(emit)
+            except Exception as e:
+                print(f"Pipeline source failed: {e}")
+                self.source_failed = True
+            finally:
+                queues[0].put(_DONE)
+
+        start = time.time()
+        threads = [threading.Thread(target=produce, name=f"{self.name}-source", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads += stage.run(self, queues[i], queues[i + 1])
+        for thread in threads:
+            thread.start()
+
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            self.results.append(item)
+        for thread in threads:
+            thread.join()
+
+        say(f"{self.name} finished in {round(time.time() - start, 1)} s")
+        for stage in self.stages:
+            say(f"\t{stage.name}: {stage.processed} processed, {stage.dropped} dropped, {stage.failed} failed, {round(stage.busy_time, 1)} s busy with {stage.workers} workers")
+        return self.results
@@ -0,0 +1,82 @@
+import json
+
+
+def bounded_size(obj, limit):
+    """
+    Counts the characters of the leaves of a nested object like `str()` of every leaf would, but stops
+    as soon as the count passes the limit.
+
+    Returns:
+        int: The number of characters, or a number above the limit if the object is larger than the limit.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, str):
+            size += len(value)
+        else:
+            size += len(str(value))
+        if size > limit:
+            return size
+    return size
+
+
+class LeafPruner:
+    """
+    Replaces the leaves of nested dictionaries whose content exceeds a number of characters with None.
+    Lists are treated as leaves. The dictionaries are walked iteratively and the size of a leaf is only
+    counted until it passes the threshold.
+
+    Statistics of what was pruned are kept per path, e.g. 'resultsSection.adverseEventsModule.eventGroups'.
+
+    Usage:
+        pruner = LeafPruner(threshold=10000)
+        pruner.prune(study)
+        pruner.report()
+    """
+
+    def __init__(self, threshold=10000):
+        self.threshold = threshold
+        self.stats = {}
+        self.documents = 0
+
+    def prune(self, data):
+        """
+        Prunes the data in place and returns it.
+        """
+        if not isinstance(data, dict):
+            return data
+        self.documents += 1
+        stack = [(data, "")]
+        while stack:
+            node, path = stack.pop()
+            for key, value in node.items():
+                if isinstance(value, dict):
+                    stack.append((value, f"{path}.{key}" if path else key))
+                elif bounded_size(value, self.threshold) > self.threshold:
+                    node[key] = None
+                    self._record(f"{path}.{key}" if path else key, value)
+        return data
+
+    def _record(self, path, value):
+        stats = self.stats.setdefault(path, {"count": 0, "max_size": 0})
+        stats["count"] += 1
+        # The size of a pruned leaf is counted only up to a multiple of the threshold to keep pruning fast
+        stats["max_size"] = max(stats["max_size"], bounded_size(value, self.threshold * 10))
+
+    def report(self, top=10):
+        """
+        Prints the paths that were pruned most often.
+        """
+        print(f"Pruned leaves of {self.documents} documents:")
+        for path, stats in sorted(self.stats.items(), key=lambda item: item[1]["count"], reverse=True)[:top]:
+            print(f"\t{stats['count']}\t{path} (up to {stats['max_size']} characters)")
+
+    def save_stats(self, file_path):
+        with open(file_path, "w") as json_file:
+            json.dump({"documents": self.documents, "threshold": self.threshold, "paths": self.stats}, json_file, indent=4)
@@ -0,0 +1,136 @@
+from datetime import datetime
+import json
+
+import numpy as np
+
+
+class ConceptScoreIndex:
+    """
+    Maps concept URIs to integer ids and keeps their relevance scores in a NumPy vector, so that
+    the concept scores of many events can be gathered at once.
+
+    Approved concepts score 100. Concepts without a positive relevance score are not counted,
+    the same way as in news.measure_event_relevance.
+    """
+
+    def __init__(self, all_concepts=None):
+        if not all_concepts:
+            with open("news/concepts.json", "r") as json_file:
+                all_concepts = json.load(json_file)
+        self.ids = {}
+        self.scores = np.zeros(0, dtype=np.float64)
+        self.valid = np.zeros(0, dtype=bool)
+        self.load(all_concepts)
+
+    def load(self, all_concepts):
+        """
+        (Re)builds the index from the contents of news/concepts.json.
+        """
+        concepts = all_concepts["concepts"]
+        self.ids = {uri: i for i, uri in enumerate(concepts)}
+        # The last slot is reserved for unknown concepts and is never counted
+        self.scores = np.zeros(len(self.ids) + 1, dtype=np.float64)
+        self.valid = np.zeros(len(self.ids) + 1, dtype=bool)
+        for uri, concept in concepts.items():
+            self.update(concept)
+
+    def update(self, concept):
+        """
+        Updates the score of a single concept, e.g. after it has been approved or disapproved.
+        """
+        i = self.ids.get(concept["uri"])
+        if i is None:
+            i = len(self.ids)
+            self.ids[concept["uri"]] = i
+            # The old unknown slot becomes the new concept and a new unknown slot is added last
+            self.scores = np.append(self.scores, 0.0)
+            self.valid = np.append(self.valid, False)
+        relevance_score = concept.get("relevance_score") or 0
+        self.valid[i] = relevance_score > 0
+        self.scores[i] = 100 if concept.get("approved") else relevance_score
+
+    def concept_ids(self, events):
+        """
+        Returns the concept ids of the events as a flat array and the index of the event for each id.
+        """
+        unknown = len(self.scores) - 1
+        flat_ids = []
+        lengths = []
+        for event in events:
+            concepts = event.get("concepts") or []
+            flat_ids += [self.ids.get(c if isinstance(c, str) else c["uri"], unknown) for c in concepts]
+            lengths.append(len(concepts))
+        event_index = np.repeat(np.arange(len(events)), lengths)
+        return np.array(flat_ids, dtype=np.int64), event_index
+
+    def concept_relevance_scores(self, events):
+        """
+        Returns the mean score of the counted concepts for each event, or 0 if none are counted.
+        """
+        flat_ids, event_index = self.concept_ids(events)
+        valid = self.valid[flat_ids]
+        sums = np.bincount(event_index, weights=np.where(valid, self.scores[flat_ids], 0.0), minlength=len(events))
+        counts = np.bincount(event_index, weights=valid, minlength=len(events))
+        return np.divide(sums, counts, out=np.zeros(len(events)), where=counts > 0)
+
+
+def time_scores(events, today=None):
+    """
+    Returns 30 minus the age of each event in days.
+    """
+    today = np.datetime64(today or datetime.today().date(), "D")
+    event_dates = np.array([event["eventDate"] for event in events], dtype="datetime64[D]")
+    return 30 - (today - event_dates).astype(np.float64)
+
+
+def score_events(events, index=None, today=None):
+    """
+    Scores all events at once with the same formula as news.measure_event_relevance.
+
+    Concept scores are always recomputed from the current curation state, while AI scores are read
+    from the stored 'ai_relevance_score' of each event. No AI model is queried, so events that have not
+    been assessed yet should go through news.measure_event_relevance first.
+
+    Args:
+        events (list): The events to score.
+        index (ConceptScoreIndex, optional): The concept index to use. Loaded from news/concepts.json if not given.
+        today (datetime.date, optional): The date to measure event age against. Defaults to today.
+
+    Returns:
+        tuple: The total scores, concept relevance scores and AI relevance scores as NumPy arrays in the order of events.
+    """
+    if index is None:
+        index = ConceptScoreIndex()
+    if not events:
+        empty = np.zeros(0)
+        return empty, empty, empty
+    concept_scores = index.concept_relevance_scores(events)
+    ai_scores = np.array([event.get("ai_relevance_score") or np.nan for event in events], dtype=np.float64)
+    has_ai = ~np.isnan(ai_scores)
+    scores = time_scores(events, today) + np.where(has_ai, (concept_scores + np.nan_to_num(ai_scores)) / 2, concept_scores)
+    return scores, concept_scores, ai_scores
+
+
+def rank_events(events, index=None, today=None):
+    """
+    Returns the events sorted by their relevance score, highest first, together with the scores by event uri.
+    """
+    scores, _, _ = score_events(events, index, today)
+    order = np.argsort(-scores, kind="stable")
+    return [events[i] for i in order], {events[i]["uri"]: float(scores[i]) for i in range(len(events))}
+
+
+def rerank_archive(index=None, today=None):
+    """
+    Re-ranks every event in news/events.json, e.g. after concepts have been approved or disapproved.
+    """
+    with open("news/events.json", "r") as json_file:
+        events = list(json.load(json_file).values())
+    return rank_events(events, index, today)
+
+
+if __name__ == "__main__":
+    ranked_events, event_scores = rerank_archive()
+    for event in ranked_events[:20]:
+        title = event["title"] if isinstance(event.get("title"), str) else event["title"].get("eng", "No title available")
+        print(f"{round(event_scores[event['uri']])}\t{event['eventDate']}\t{title}")
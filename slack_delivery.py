@@ -0,0 +1,212 @@
+from datetime import datetime
+import json
+import queue
+import threading
+import time
+
+from decouple import config
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import say
+
+TIMEOUT = (5, 15)
+# Slack accepts about one message per second on an incoming webhook
+MIN_INTERVAL = 1.0
+# Slack rejects messages with more blocks than this
+MAX_BLOCKS = 50
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the pooled HTTP session shared by all Slack deliveries of this process.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+            _session.mount("https://", adapter)
+    return _session
+
+
+def to_payload(message, json_mode=False):
+    if json_mode:
+        return message, {"Content-Type": "application/json"}
+    return {"text": message}, {"Content-Type": "text/plain"}
+
+
+def send_to_slack(payload, headers, url=None, max_retries=5, backoff=2.0):
+    """
+    Sends one message to the Slack webhook, retrying rate-limited and failed requests with exponential backoff.
+    Retry-After headers of rate-limited responses are honored.
+
+    Returns:
+        tuple: Whether the message was delivered, the last status code (None on connection errors) and the number of attempts.
+    """
+    url = url or config("SLACK_WEBHOOK_URL")
+    status = None
+    for attempt in range(1, max_retries + 1):
+        wait = backoff ** (attempt - 1)
+        try:
+            response = get_session().post(url, json=payload, headers=headers, timeout=TIMEOUT)
+            status = response.status_code
+            if status == 200:
+                return True, status, attempt
+            if status == 429:
+                wait = float(response.headers.get("Retry-After", wait))
+            elif status < 500:
+                # Client errors such as invalid blocks will not succeed on a retry
+                print(f"Failed to post to Slack: {response.text}")
+                return False, status, attempt
+            say(f"Slack responded {status}, retrying in {wait} s")
+        except requests.exceptions.RequestException as e:
+            say(f"Failed to reach Slack ({e}), retrying in {wait} s")
+        if attempt < max_retries:
+            time.sleep(wait)
+    print(f"Failed to post to Slack after {max_retries} attempts (last status {status})")
+    return False, status, max_retries
+
+
+def combine_messages(messages):
+    """
+    Combines several JSON messages into digest messages of at most MAX_BLOCKS blocks, separated by dividers.
+    """
+    digests = []
+    blocks = []
+    texts = []
+    for message in messages:
+        message_blocks = message.get("blocks") or [{"type": "section", "text": {"type": "mrkdwn", "text": message.get("text", "")}}]
+        if blocks and len(blocks) + 1 + len(message_blocks) > MAX_BLOCKS:
+            digests.append({"text": "\n".join(texts), "blocks": blocks})
+            blocks, texts = [], []
+        if blocks:
+            blocks.append({"type": "divider"})
+        blocks += message_blocks
+        texts.append(message.get("text", ""))
+    if blocks:
+        digests.append({"text": "\n".join(texts), "blocks": blocks})
+    return digests
+
+
+class SlackDeliveryQueue:
+    """
+    Delivers Slack messages from a background worker, so that posting never blocks the caller.
+
+    Messages are sent in order over a pooled session at most once per MIN_INTERVAL seconds, with retries
+    and backoff. With digest_size above 1, up to that many queued messages are combined into one digest
+    message. Every outcome is recorded, and on_success is called only after Slack accepted the message,
+    so ledgers of posted items can be updated from there.
+
+    Usage:
+        with SlackDeliveryQueue() as slack:
+            slack.submit(block, json_mode=True, on_success=lambda: posts.append(item))
+    """
+
+    def __init__(self, url=None, digest_size=1, digest_wait=2.0, max_retries=5, log_file=None):
+        self.url = url
+        self.digest_size = digest_size
+        self.digest_wait = digest_wait
+        self.max_retries = max_retries
+        self.log_file = log_file
+        self.outcomes = []
+        self._queue = queue.Queue()
+        self._thread = None
+        self._last_sent = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name="slack-delivery", daemon=True)
+            self._thread.start()
+
+    def submit(self, message, json_mode=False, on_success=None, on_failure=None, key=None):
+        """
+        Queues a message for delivery and returns right away.
+
+        Args:
+            message (str or dict): The text, or the JSON message with blocks if json_mode is True.
+            json_mode (bool, optional): Whether the message is a JSON message. Defaults to False.
+            on_success (function, optional): Called without arguments after the message has been delivered.
+            on_failure (function, optional): Called without arguments if the message could not be delivered.
+            key (str, optional): An identifier of the message for the delivery log.
+        """
+        self.start()
+        payload = message if json_mode else {"text": message}
+        self._queue.put({"payload": payload, "on_success": on_success, "on_failure": on_failure, "key": key})
+
+    def flush(self):
+        """
+        Waits until every queued message has been delivered or has failed.
+        """
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self.log_file and self.outcomes:
+            with open(self.log_file, "a") as log:
+                for outcome in self.outcomes:
+                    log.write(json.dumps(outcome) + "\n")
+            self.outcomes = []
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            self._queue.task_done()
+            return None
+        batch = [item]
+        deadline = time.time() + self.digest_wait
+        while len(batch) < self.digest_size:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the stop signal back so that the worker stops after this batch
+                self._queue.task_done()
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            payloads = [item["payload"] for item in batch]
+            messages = combine_messages(payloads) if len(batch) > 1 else payloads
+            delivered = True
+            attempts = 0
+            for message in messages:
+                wait = self._last_sent + MIN_INTERVAL - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                ok, status, message_attempts = send_to_slack(message, {"Content-Type": "application/json"}, self.url, self.max_retries)
+                self._last_sent = time.time()
+                delivered = delivered and ok
+                attempts += message_attempts
+            with self._lock:
+                self.outcomes += [{"key": item["key"], "delivered": delivered, "status": status, "attempts": attempts, "time": datetime.now().isoformat(timespec="seconds")} for item in batch]
+            for item in batch:
+                callback = item["on_success"] if delivered else item["on_failure"]
+                if callback:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(f"Slack delivery callback failed: {e}")
+                self._queue.task_done()
@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+# The modules behind news.command and the curation tools
+ENTRY_POINTS = ["news", "trials", "main", "data_management", "concept_manager"]
+# Warn if an entry point takes this much longer to import than in the previous measurement
+REGRESSION_TOLERANCE = 1.2
+RESULTS_FILE = "startup_times.json"
+
+
+def measure_import_time(module, repeats=3):
+    """
+    Imports the module in a fresh interpreter with 'python -X importtime' and parses the timings.
+
+    Args:
+        module (str): The name of the module to import.
+        repeats (int, optional): The number of cold starts to measure. The fastest one is reported. Defaults to 3.
+
+    Returns:
+        dict: The total import time in milliseconds and the ten slowest direct imports, or the error if the import failed.
+    """
+    best = None
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            parts = line[len("import time:"):].split("|")
+            try:
+                cumulative = int(parts[1].strip())
+            except ValueError:
+                continue
+            name = parts[2].rstrip()
+            # Nested imports are indented by two spaces per level, keep the module and what it imports directly
+            level = (len(name) - len(name.lstrip()) - 1) // 2
+            if level <= 1:
+                timings[name.strip()] = cumulative
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"}
+        total = timings.pop(module, sum(timings.values()))
+        if best is None or total < best["total_ms"] * 1000:
+            slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:10]
+            best = {
+                "total_ms": round(total / 1000, 1),
+                "slowest_imports_ms": {name: round(us / 1000, 1) for name, us in slowest}
+            }
+    return best
+
+
+def run_benchmark(entry_points=ENTRY_POINTS, results_file=RESULTS_FILE):
+    """
+    Measures the cold-start import time of every entry point, prints a report and appends it to the results file.
+    A warning is printed for entry points that got slower than in the previous measurement.
+    """
+    try:
+        with open(results_file, "r") as json_file:
+            history = json.load(json_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        history = []
+    previous = history[-1]["entry_points"] if history else {}
+
+    measurements = {}
+    for module in entry_points:
+        measurement = measure_import_time(module)
+        measurements[module] = measurement
+        if "error" in measurement:
+            print(f"{module}: import failed ({measurement['error']})")
+            continue
+        print(f"{module}: {measurement['total_ms']} ms")
+        for name, ms in measurement["slowest_imports_ms"].items():
+            print(f"\t{ms} ms\t{name}")
+        before = previous.get(module, {}).get("total_ms")
+        if before and measurement["total_ms"] > before * REGRESSION_TOLERANCE:
+            print(f"WARNING: {module} starts slower than before ({before} ms -> {measurement['total_ms']} ms)")
+
+    history.append({
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "entry_points": measurements
+    })
+    with open(results_file, "w") as json_file:
+        json.dump(history, json_file, indent=4)
+    return measurements
+
+
+if __name__ == "__main__":
+    run_benchmark(sys.argv[1:] or ENTRY_POINTS)
@@ -0,0 +1,90 @@
+import json
+import zlib
+
+
+class Study:
+    """
+    Compact record of a clinical study with the fields the trials jobs read, for read-only uses such as
+    queries over the archive and choosing the studies to post. Merges keep working on the documents.
+
+    The full JSON document of the study is kept zlib-compressed and decoded only when `raw` is accessed,
+    e.g. for the results section, so a large number of studies fits in a fraction of the memory of the
+    parsed documents.
+
+    Usage:
+        study = Study.from_json(document)
+        print(study.nct_id, study.phases, study.conditions)
+        results = study.raw.get("resultsSection")
+    """
+
+    __slots__ = ("nct_id", "official_title", "brief_title", "overall_status", "phases", "last_update_post_date",
+                 "last_update_submit_date", "conditions", "std_ages", "lead_sponsor", "collaborators", "has_results",
+                 "relevance", "_raw")
+
+    def __init__(self, nct_id, official_title="", brief_title="", overall_status="", phases=(), last_update_post_date=None,
+                 last_update_submit_date=None, conditions=(), std_ages=(), lead_sponsor="", collaborators=(), has_results=False,
+                 relevance=None, raw=None):
+        self.nct_id = nct_id
+        self.official_title = official_title
+        self.brief_title = brief_title
+        self.overall_status = overall_status
+        self.phases = tuple(phases)
+        self.last_update_post_date = last_update_post_date
+        self.last_update_submit_date = last_update_submit_date
+        self.conditions = tuple(conditions)
+        self.std_ages = tuple(std_ages)
+        self.lead_sponsor = lead_sponsor
+        self.collaborators = tuple(collaborators)
+        self.has_results = has_results
+        self.relevance = relevance
+        self._raw = zlib.compress(json.dumps(raw, separators=(",", ":")).encode()) if raw is not None else None
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Creates the record from a study document of the ClinicalTrials.gov API or the trials archive.
+        """
+        protocol = data.get("protocolSection", {})
+        identification = protocol.get("identificationModule", {})
+        status = protocol.get("statusModule", {})
+        sponsors = protocol.get("sponsorCollaboratorsModule", {})
+        return cls(
+            identification["nctId"],
+            official_title=identification.get("officialTitle", ""),
+            brief_title=identification.get("briefTitle", ""),
+            overall_status=status.get("overallStatus", ""),
+            phases=protocol.get("designModule", {}).get("phases", []),
+            last_update_post_date=status.get("lastUpdatePostDateStruct", {}).get("date"),
+            last_update_submit_date=status.get("lastUpdateSubmitDate"),
+            conditions=protocol.get("conditionsModule", {}).get("conditions", []),
+            std_ages=protocol.get("eligibilityModule", {}).get("stdAges", []),
+            lead_sponsor=sponsors.get("leadSponsor", {}).get("name", ""),
+            collaborators=[collaborator["name"] for collaborator in sponsors.get("collaborators", [])],
+            has_results=data.get("hasResults", False),
+            relevance=data.get("biie", {}).get("relevance"),
+            raw=data
+        )
+
+    @property
+    def raw(self):
+        """
+        The full JSON document of the study, decoded on every access.
+        """
+        if self._raw is None:
+            return None
+        return json.loads(zlib.decompress(self._raw))
+
+    @property
+    def title(self):
+        return self.official_title or self.brief_title
+
+    @property
+    def last_update(self):
+        return self.last_update_post_date or self.last_update_submit_date or ""
+
+    @property
+    def url(self):
+        return f"https://clinicaltrials.gov/study/{self.nct_id}"
+
+    def __repr__(self):
+        return f"Study({self.nct_id}, {self.title!r})"
@@ -0,0 +1,53 @@
+import random
+
+from near_duplicates import NearDuplicateIndex, choose_bands, shingles
+
+
+def _pair_with_similarity(similarity, length=400, seed=0):
+    """
+    Returns two texts of distinct words whose shingle sets have about the given Jaccard similarity.
+    """
+    rng = random.Random(seed)
+    words = [f"w{rng.randrange(10 ** 9)}" for _ in range(length)]
+    # The texts share a prefix of words, so J = shared / (2 * length - shared) for the shingles as well
+    shared = round(length * 2 * similarity / (1 + similarity))
+    changed = list(words)
+    for i in range(shared, length):
+        changed[i] = f"x{rng.randrange(10 ** 9)}"
+    return " ".join(words), " ".join(changed)
+
+
+def _jaccard(first, second):
+    first, second = set(shingles(first).tolist()), set(shingles(second).tolist())
+    return len(first & second) / len(first | second)
+
+
+def test_candidate_cutoff_is_at_or_below_threshold():
+    for threshold in [0.5, 0.7, 0.8, 0.9]:
+        bands, rows = choose_bands(128, threshold)
+        assert bands * rows == 128
+        assert (1 / bands) ** (1 / rows) <= threshold
+
+
+def test_recall_at_threshold():
+    first, second = _pair_with_similarity(0.8)
+    assert abs(_jaccard(first, second) - 0.8) < 0.02
+    found = 0
+    for seed in range(50):
+        index = NearDuplicateIndex(threshold=0.8, seed=seed)
+        index.add("first", first)
+        signature = index.signature(second)
+        candidates = set()
+        for bucket, band_key in zip(index.buckets, index._band_keys(signature)):
+            candidates |= bucket.get(band_key, set())
+        found += "first" in candidates
+    assert found / 50 >= 0.85
+
+
+def test_query_finds_near_duplicates_only():
+    first, second = _pair_with_similarity(0.9)
+    _, unrelated = _pair_with_similarity(0.0, seed=1)
+    index = NearDuplicateIndex(threshold=0.8)
+    index.add("first", first)
+    assert [key for key, _ in index.query(second)] == ["first"]
+    assert index.query(unrelated) == []
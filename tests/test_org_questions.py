@@ -0,0 +1,46 @@
+import pytest
+
+from org_questions import parse_answer
+
+
+@pytest.mark.parametrize("answer, property_type, expected", [
+    ("approximately 1,200 staff", "integer", 1200),
+    ("2.5 million", "float", 2500000.0),
+    ("3,5", "float", 3.5),
+    ("-4", "integer", -4),
+    ("1.000.000", "integer", 1000000),
+    ("1.000,5", "float", 1000.5),
+    ("0.125", "float", 0.125),
+    ("Answer: 42", "Integer.", 42),
+    (42, "integer", 42),
+    ("Yes, they do", "boolean", True),
+    ("No.", "boolean", False),
+    ("false", "boolean", False),
+    ('```json\n["a", "b"]\n```', "list", ["a", "b"]),
+    ("The answer is {'a': 1}.", "dictionary", {"a": 1}),
+    ("Helsinki", "string", "Helsinki"),
+])
+def test_parses_answers(answer, property_type, expected):
+    assert parse_answer(answer, property_type) == (True, expected)
+
+
+@pytest.mark.parametrize("answer, property_type", [
+    ("In 2019, about 1,200 staff", "integer"),
+    ("10-20", "integer"),
+    ("10–20 employees", "integer"),
+    ("between 10 and 20", "float"),
+    ("5th", "integer"),
+    ("the 2nd largest", "integer"),
+    ("1.000", "integer"),
+    ("A380", "integer"),
+    ("none", "integer"),
+    (True, "integer"),
+    ("10 employees", "boolean"),
+    ("1", "boolean"),
+    ("maybe", "boolean"),
+    ("not a list", "list"),
+    (None, "string"),
+    ("", "string"),
+])
+def test_rejects_unclear_answers(answer, property_type):
+    assert parse_answer(answer, property_type) == (False, None)
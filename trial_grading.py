@@ -0,0 +1,144 @@
+import concurrent.futures
+import json
+import os
+import threading
+
+from ai_apis import ask_ai
+from trials_index import last_update_post_date
+from utils import say
+
+GRADES_FILE = "trials/grades.json"
+# NCT IDs of archived studies that changed outside the regular search, e.g. in a bulk import, and still need grading
+QUEUE_FILE = "trials/grading_queue.json"
+# Studies scoring above this get a summary
+SUMMARY_THRESHOLD = 80
+
+
+def relevance_prompt(study):
+    protocol = study["protocolSection"]
+    description = protocol["descriptionModule"].get("detailedDescription") or protocol["descriptionModule"]["briefSummary"]
+    title = protocol['identificationModule']['officialTitle']
+    status = protocol['statusModule']['overallStatus']
+    phase = ', '.join(protocol['designModule']['phases']) if 'phases' in protocol.get('designModule', {}) else ''
+    return f"Please estimate the relevance of the following clinical study with a score from 0 (least relevant) to 100 (most relevant). In your estimation, the following factors carry the most weight in this order: 1) Relevance on child and adolescent health 2) Relevance to global health (not only local) 3) Phase and status of the study. Please give your integer estimate in JSON format under the key 'relevance'.\n===Study===\nTitle: {title}\nPhase: {phase}\nStatus: {status}\nDescription: {description}"
+
+
+def grade_key(id, study):
+    return f"{id}@{last_update_post_date(study)}"
+
+
+def load_grading_queue(queue_file=QUEUE_FILE):
+    try:
+        with open(queue_file, "r") as json_file:
+            return set(json.load(json_file))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return set()
+
+
+def save_grading_queue(ids, queue_file=QUEUE_FILE):
+    with open(queue_file, "w") as json_file:
+        json.dump(sorted(ids), json_file)
+
+
+def queue_for_grading(ids, queue_file=QUEUE_FILE):
+    """
+    Adds the studies to the grading queue, which the next post_new_trials_on_slack run grades.
+    """
+    ids = set(ids)
+    if ids:
+        save_grading_queue(load_grading_queue(queue_file) | ids, queue_file)
+
+
+class TrialGrader:
+    """
+    Grades the relevance of studies and summarizes the relevant ones with bounded concurrency.
+
+    Grades are memoized by NCT ID and lastUpdatePostDate in GRADES_FILE, which is saved as the grades
+    come in, so unchanged studies are never graded twice and an interrupted run loses little work.
+
+    Usage:
+        grader = TrialGrader(describe=describe_study)
+        grader.grade_all(studies)
+    """
+
+    def __init__(self, describe=None, grades_file=GRADES_FILE, workers=8, save_every=10):
+        self.describe = describe
+        self.grades_file = grades_file
+        self.workers = workers
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        try:
+            with open(grades_file, "r") as json_file:
+                self.grades = json.load(json_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.grades = {}
+
+    def grade(self, id, study):
+        """
+        Returns the grade of the study as a dictionary with the relevance and, for relevant studies, the summary.
+        """
+        key = grade_key(id, study)
+        with self._lock:
+            if key in self.grades:
+                return self.grades[key]
+        grade = {}
+        response = ask_ai(relevance_prompt(study), json_mode=True)
+        if not response:
+            return grade
+        try:
+            grade["relevance"] = int(json.loads(response)["relevance"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Could not read the relevance of {id}: {e}")
+            return grade
+        if grade["relevance"] > SUMMARY_THRESHOLD and self.describe:
+            grade["summary"] = self.describe(study, print_it=False, add_title=False)
+        with self._lock:
+            self.grades[key] = grade
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save()
+        return grade
+
+    def grade_all(self, studies):
+        """
+        Grades the studies concurrently and stores the results under study["biie"].
+        Studies that already have a relevance are left as they are.
+
+        Args:
+            studies (dict): The studies to grade by NCT ID.
+
+        Returns:
+            int: The number of studies that had to be graded by the AI model.
+        """
+        studies = {id: study for id, study in studies.items() if "relevance" not in study.get("biie", {})}
+        pending = [id for id, study in studies.items() if grade_key(id, study) not in self.grades]
+        say(f"Grading {len(pending)} studies, {len(studies) - len(pending)} already graded")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.grade, id, study): id for id, study in studies.items()}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                id = futures[future]
+                try:
+                    grade = future.result()
+                except Exception as e:
+                    print(f"Failed to grade {id}: {e}")
+                    continue
+                study = studies[id]
+                study.setdefault("biie", {})
+                study["biie"]["url"] = f"https://clinicaltrials.gov/study/{id}"
+                study["biie"].update(grade)
+                if done % 50 == 0:
+                    say(f"Graded {done}/{len(studies)} studies")
+        self.save()
+        return len(pending)
+
+    def _save(self):
+        temporary_file = self.grades_file + ".tmp"
+        with open(temporary_file, "w") as json_file:
+            json.dump(self.grades, json_file)
+        os.replace(temporary_file, self.grades_file)
+        self._unsaved = 0
+
+    def save(self):
+        with self._lock:
+            self._save()
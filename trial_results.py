@@ -0,0 +1,117 @@
+MAX_TOKENS = 1500
+# Rough number of characters per token, close enough for budgeting without loading a tokenizer
+CHARACTERS_PER_TOKEN = 4
+MAX_ADVERSE_EVENTS = 5
+
+
+def estimate_tokens(text):
+    return len(text) // CHARACTERS_PER_TOKEN + 1
+
+
+def format_value(measurement):
+    value = str(measurement.get("value", "NA"))
+    if measurement.get("spread"):
+        value += f" ±{measurement['spread']}"
+    elif measurement.get("lowerLimit") or measurement.get("upperLimit"):
+        value += f" [{measurement.get('lowerLimit', '')}, {measurement.get('upperLimit', '')}]"
+    return value
+
+
+def outcome_lines(outcome, with_analyses=True):
+    """
+    Renders one outcome measure as a few tabular lines: the groups, their sizes, the measurements per
+    category and the statistical analyses.
+    """
+    groups = {group["id"]: group.get("title", group["id"]) for group in outcome.get("groups", [])}
+    unit = ", ".join(part for part in [outcome.get("paramType"), outcome.get("unitOfMeasure"), outcome.get("timeFrame")] if part)
+    lines = [f"{outcome.get('type', 'OUTCOME')} OUTCOME: {outcome.get('title', '')}" + (f" ({unit})" if unit else "")]
+    if groups:
+        lines.append("  Groups: " + "; ".join(f"{id}={title}" for id, title in groups.items()))
+    for denom in outcome.get("denoms", [])[:1]:
+        lines.append(f"  N ({denom.get('units', 'participants')}): " + " | ".join(f"{count['groupId']} {count['value']}" for count in denom.get("counts", [])))
+    for outcome_class in outcome.get("classes", []):
+        for category in outcome_class.get("categories", []):
+            label = " / ".join(title for title in [outcome_class.get("title"), category.get("title")] if title)
+            values = " | ".join(f"{measurement['groupId']} {format_value(measurement)}" for measurement in category.get("measurements", []))
+            lines.append(f"  {label + ': ' if label else ''}{values}")
+    if with_analyses:
+        for analysis in outcome.get("analyses", []):
+            parts = []
+            if analysis.get("pValue"):
+                parts.append(f"p={analysis['pValue']}")
+            if analysis.get("statisticalMethod"):
+                parts.append(analysis["statisticalMethod"])
+            if analysis.get("paramValue"):
+                estimate = f"{analysis.get('paramType', 'estimate')} {analysis['paramValue']}"
+                if analysis.get("ciLowerLimit") or analysis.get("ciUpperLimit"):
+                    estimate += f" [{analysis.get('ciPctValue', '95')}% CI {analysis.get('ciLowerLimit', '')}, {analysis.get('ciUpperLimit', '')}]"
+                parts.append(estimate)
+            if parts:
+                lines.append(f"  Analysis {' vs '.join(analysis.get('groupIds', []))}: " + "; ".join(parts))
+    return lines
+
+
+def adverse_event_lines(adverse_events, max_events=MAX_ADVERSE_EVENTS):
+    """
+    Renders the adverse-event totals per group and the most common serious adverse events.
+    """
+    groups = adverse_events.get("eventGroups", [])
+    if not groups:
+        return []
+    lines = [f"ADVERSE EVENTS{' (' + adverse_events['timeFrame'] + ')' if adverse_events.get('timeFrame') else ''}:"]
+    for group in groups:
+        totals = []
+        for kind in ["deaths", "serious", "other"]:
+            if group.get(f"{kind}NumAffected") is not None:
+                totals.append(f"{kind} {group[f'{kind}NumAffected']}/{group.get(f'{kind}NumAtRisk', '?')}")
+        lines.append(f"  {group['id']}={group.get('title', '')}: " + ", ".join(totals))
+    serious = sorted(adverse_events.get("seriousEvents", []), key=lambda event: sum(stats.get("numAffected", 0) for stats in event.get("stats", [])), reverse=True)
+    for event in serious[:max_events]:
+        lines.append(f"  Serious {event.get('term', '')}: " + " | ".join(f"{stats['groupId']} {stats.get('numAffected', '?')}/{stats.get('numAtRisk', '?')}" for stats in event.get("stats", [])))
+    return lines
+
+
+def compact_results(results_section, max_tokens=MAX_TOKENS):
+    """
+    Extracts the data a results summary needs from the resultsSection of a study into compact tabular text.
+
+    The parts are added in order of importance until the token budget is used: the primary outcome
+    measures with their group statistics, the adverse-event totals, the secondary outcome measures
+    without their analyses and finally the most common serious adverse events.
+
+    Args:
+        results_section (dict): The resultsSection of the study.
+        max_tokens (int, optional): The token budget of the text. Defaults to MAX_TOKENS.
+
+    Returns:
+        str: The compact results, or an empty string if there are none.
+    """
+    if not results_section:
+        return ""
+    outcomes = (results_section.get("outcomeMeasuresModule") or {}).get("outcomeMeasures") or []
+    adverse_events = results_section.get("adverseEventsModule") or {}
+    ae_lines = adverse_event_lines(adverse_events)
+    ae_totals = ae_lines[:1 + len(adverse_events.get("eventGroups", []))]
+    parts = [outcome_lines(outcome) for outcome in outcomes if outcome.get("type") == "PRIMARY"]
+    parts.append(ae_totals)
+    parts += [outcome_lines(outcome, with_analyses=False) for outcome in outcomes if outcome.get("type") != "PRIMARY"]
+    parts.append(ae_lines[len(ae_totals):])
+
+    text = ""
+    for lines in parts:
+        for line in lines:
+            if estimate_tokens(text + line) > max_tokens:
+                return text.strip()
+            text += line + "\n"
+    return text.strip()
+
+
+def add_results_digest(study, max_tokens=MAX_TOKENS):
+    """
+    Stores the compact results of the study under study["biie"]["results_digest"], before pruning can
+    remove the large parts of its resultsSection.
+    """
+    digest = compact_results(study.get("resultsSection"), max_tokens)
+    if digest:
+        study.setdefault("biie", {})["results_digest"] = digest
+    return study
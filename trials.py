@@ -1,9 +1,14 @@
 import json
 import os
 import requests
-from json.decoder import JSONDecodeError
 from ai_apis import ask_ai
-from utils import post_to_slack
+from slack_delivery import SlackDeliveryQueue
+from study import Study
+from pruning import LeafPruner, bounded_size
+from trial_grading import TrialGrader, load_grading_queue, save_grading_queue
+from trial_results import add_results_digest, compact_results
+from trials_fetcher import STUDY_FIELDS, fetch_combined_conditions, fetch_conditions, fetch_pages, merge_projection
+from trials_index import ConditionIndex, StudyIndex, study_delta, study_fingerprint
 
 
 def post_new_trials_on_slack(threshold=85):
@@ -16,10 +21,10 @@ def post_new_trials_on_slack(threshold=85):
     Workflow:
         1. Load settings and conditions from JSON files.
         2. Retrieve all studies and filter out the first one.
-        3. Identify brand new studies based on conditions and update the studies dictionary.
-        4. Save the updated studies and settings back to their respective JSON files.
-        5. Grade and render the most relevant studies using an AI model.
-        6. Post the most relevant studies on Slack, ensuring no duplicates are posted.
+        3. Fetch the conditions concurrently, identify brand new and changed studies and update the studies dictionary.
+        4. Grade and render the most relevant of the new and changed studies using an AI model, and save the studies.
+        5. Post the most relevant studies on Slack, ensuring no duplicates are posted.
+        6. Save the study index and settings, so that a run that fails earlier fetches and grades the same changes again.
 
     Raises:
         Any exceptions related to file I/O or JSON parsing will be handled gracefully.
@@ -35,58 +40,36 @@ def post_new_trials_on_slack(threshold=85):
     print(studies[k]["protocolSection"]["statusModule"]["lastUpdatePostDateStruct"]["date"], studies[k]['protocolSection']['identificationModule']['officialTitle'], studies[k]["protocolSection"]["conditionsModule"]["conditions"])
     del studies[k]
 
-    brand_new_studies = {}
-    for keyword in conditions:
-        additional_studies, studies = latest_trials_data_by_condition(
-            keyword,
-            studies=studies,
-            since=settings.get("last_search_date", "2024-09-01"),
-            save=False)
-        brand_new_studies.update(additional_studies)
-
-    with open("trials/trials.json", "w") as f:
-        f.write(json.dumps(studies, indent=4))
-
-    try:
-        lookup_date = sorted([s["protocolSection"]["statusModule"]["lastUpdatePostDateStruct"][
-                                  "date"] if "lastUpdatePostDateStruct" in s["protocolSection"][
-            "statusModule"] else None for k, s in studies.items()])[-1]
-        settings["last_search_date"] = lookup_date
-    except IndexError:
-        pass
+    study_index = StudyIndex(studies=studies)
+    failed_conditions = []
+    brand_new_studies, studies = latest_trials_data_by_conditions(
+        conditions,
+        studies=studies,
+        since=settings.get("last_search_date", "2024-09-01"),
+        study_index=study_index,
+        failed_conditions=failed_conditions,
+        save_index=False)
+
+    if failed_conditions:
+        # Search the same period again next time, so that the missed studies are fetched
+        print("Keeping the last search date", settings.get("last_search_date"))
+    else:
+        try:
+            lookup_date = sorted([s["protocolSection"]["statusModule"]["lastUpdatePostDateStruct"][
+                                      "date"] if "lastUpdatePostDateStruct" in s["protocolSection"][
+                "statusModule"] else None for k, s in studies.items()])[-1]
+            settings["last_search_date"] = lookup_date
+        except IndexError:
+            pass
 
-    with open("trials/settings.json", "w") as settings_file:
-        settings_file.write(json.dumps(settings, indent=4))
     print(len(list(brand_new_studies.keys())), "new studies found in total")
-    # Grade and render the most relevant studies
-    for id, study in brand_new_studies.items():
-        if "biie" not in study:
-            study["biie"] = {}
-        study["biie"]["url"] = f"https://clinicaltrials.gov/study/{id}"
-
-        if "relevance" not in study["biie"]:
-            description = study["protocolSection"]["descriptionModule"]["detailedDescription"] if "detailedDescription" in \
-                                                                                                  study["protocolSection"][
-                                                                                                      "descriptionModule"] else \
-            study["protocolSection"]["descriptionModule"]["briefSummary"]
-            title = study['protocolSection']['identificationModule']['officialTitle']
-            status = study['protocolSection']['statusModule']['overallStatus']
-            phase = ', '.join(study['protocolSection']['designModule']['phases']) if 'phases' in study['protocolSection'][
-                'designModule'] else ''
-            response = ask_ai(
-                f"Please estimate the relevance of the following clinical study with a score from 0 (least relevant) to 100 (most relevant). In your estimation, the following factors carry the most weight in this order: 1) Relevance on child and adolescent health 2) Relevance to global health (not only local) 3) Phase and status of the study. Please give your integer estimate in JSON format under the key 'relevance'.\n===Study===\nTitle: {title}\nPhase: {phase}\nStatus: {status}\nDescription: {description}",
-                json_mode=True)
-            if response:
-                study["biie"]["relevance"] = json.loads(response)["relevance"]
-
-        if study["biie"]["relevance"] > 80:
-            summary = describe_study(study, add_title=False)
-            study["biie"]["summary"] = summary
-
-        studies[id] = study
-        brand_new_studies[id] = study
-    with open("trials/trials.json", "w") as f:
-        f.write(json.dumps(studies, indent=4))
+    # Grade and render the most relevant of the new and changed studies, and of those queued by the bulk importer
+    queued = load_grading_queue()
+    studies_to_grade = {id: studies[id] for id in set(study_index.changes) | queued if id in studies}
+    TrialGrader(describe=describe_study).grade_all(studies_to_grade)
+    save_studies(studies)
+    if queued:
+        save_grading_queue(id for id in queued if id in studies and "relevance" not in studies[id].get("biie", {}))
 
     # Post on slack
     try:
@@ -95,19 +78,28 @@ def post_new_trials_on_slack(threshold=85):
     except:
         slack_posts = []
     max_posts = 2
-    posts = 0
-    new_study_list = list(brand_new_studies.values())
-    new_study_list.sort(key=lambda s: s["biie"]["relevance"], reverse=True)
-    for study in new_study_list:
-        if posts >= max_posts:
-            break
-        if study["protocolSection"]["identificationModule"]["nctId"] in [s["protocolSection"]["identificationModule"]["nctId"] for s in slack_posts]:
+    # The IDs of the studies that Slack has accepted
+    delivered = []
+    in_flight = 0
+    posted_ids = set(s["protocolSection"]["identificationModule"]["nctId"] for s in slack_posts)
+    # The candidates are sorted and filtered as compact records, only the posted ones are read in full
+    candidates = [Study.from_json(study) for study in brand_new_studies.values()]
+    candidates.sort(key=lambda record: record.relevance or 0, reverse=True)
+    slack = SlackDeliveryQueue(log_file="trials/slack_deliveries.jsonl")
+    for record in candidates:
+        if len(delivered) + in_flight >= max_posts:
+            # Wait for the messages in flight, a failed delivery frees its slot for the next study
+            slack.flush()
+            in_flight = 0
+            if len(delivered) >= max_posts:
+                break
+        if record.nct_id in posted_ids:
             continue
-        if study["biie"]["relevance"] >= threshold:
-            title = study['protocolSection']['identificationModule']['officialTitle']
-            status = study['protocolSection']['statusModule']['overallStatus']
-            phase = ', '.join(study['protocolSection']['designModule']['phases']) if 'phases' in study['protocolSection'][
-                'designModule'] else ''
+        if (record.relevance or 0) >= threshold:
+            study = brand_new_studies[record.nct_id]
+            title = record.official_title
+            status = record.overall_status
+            phase = ', '.join(record.phases)
             block = {
                 "text": f"New trial: {title}",
                 "blocks": [
@@ -139,62 +131,60 @@ def post_new_trials_on_slack(threshold=85):
                     }
                 ]
             }
-            if post_to_slack(block, True):
-                posts += 1
+            def on_success(study=study):
+                # The ledger is only updated once Slack has accepted the message
                 slack_posts.append(study)
+                delivered.append(study["protocolSection"]["identificationModule"]["nctId"])
+
+            slack.submit(block, True, on_success=on_success, key=record.nct_id)
+            in_flight += 1
+    slack.close()
     with open("trials/slack_posts.json", "w") as json_file:
         json.dump(slack_posts, json_file, indent=4)
 
+    # Only now are the changes marked as seen, so that a run that fails before this point grades them again
+    study_index.save()
+    with open("trials/settings.json", "w") as settings_file:
+        settings_file.write(json.dumps(settings, indent=4))
+
 
-def get_all_studies():
+def get_all_studies(compact=False):
     """
-    Load all the studies saved in the archive
+    Load all the studies saved in the archive, as compact Study records if compact is True
     """
     try:
         with open("trials/trials.json", 'r') as studies_file:
             studies = json.load(studies_file)
     except:
         return {}
+    if compact:
+        return {id: Study.from_json(study) for id, study in studies.items()}
     return studies
 
 
-def count_characters(obj):
+def count_characters(obj, limit=float("inf")):
     """
-    Recursively counts the total number of characters in a given object.
+    Counts the total number of characters in a given object, stopping once the count passes the limit.
     """
-    if isinstance(obj, dict):
-        return sum(count_characters(v) for v in obj.values())
-    elif isinstance(obj, list):
-        return sum(count_characters(item) for item in obj)
-    else:
-        return len(str(obj))
+    return bounded_size(obj, limit)
 
 
-def remove_large_leaves(data, threshold=10000):
+def remove_large_leaves(data, threshold=10000, pruner=None):
     """
-    Recursively removes leaf nodes (keys) from the dictionary if their content exceeds the threshold.
-    A list is treated as a leaf.
+    Removes leaf nodes (keys) from the dictionary if their content exceeds the threshold.
+    A list is treated as a leaf. Pass a LeafPruner to collect statistics over many documents.
     """
-    if not isinstance(data, dict):
-        return data
+    pruner = pruner or LeafPruner(threshold)
+    return pruner.prune(data)
 
-    keys_to_remove = []
 
-    # Iterate over each key-value pair
-    for key, value in data.items():
-        # If the value is a dictionary, apply the function recursively
-        if isinstance(value, dict):
-            data[key] = remove_large_leaves(value, threshold)
-        else:
-            # Check the character count of the current leaf
-            if count_characters(value) > threshold:
-                keys_to_remove.append(key)
+def study_id(study):
+    return study["protocolSection"]["identificationModule"]["nctId"]
 
-    # Remove the keys that exceeded the threshold
-    for key in keys_to_remove:
-        data[key] = None
 
-    return data
+def save_studies(studies):
+    with open("trials/trials.json", "w") as f:
+        f.write(json.dumps(studies, indent=4))
 
 
 def latest_trials_data_by_condition(condition_name, studies=None, since=False, save=True):
@@ -220,40 +210,134 @@ def latest_trials_data_by_condition(condition_name, studies=None, since=False, s
     - The function prints the number of new studies found, the total number of studies returned from the API,
       and the number of studies already existing in the archive for the specified condition.
     """
+    return latest_trials_data_by_conditions([condition_name], studies=studies, since=since, save=save, max_workers=1, combine=False)
 
-    url = "https://clinicaltrials.gov/api/v2/studies"
+
+def latest_trials_data_by_conditions(conditions, studies=None, since=False, save=True, max_workers=4, requests_per_second=3, combine=True, projected=True, condition_index=None, study_index=None, failed_conditions=None, save_index=True):
+    """
+    Fetches and updates clinical trials data for many conditions at once from the ClinicalTrials.gov API.
+
+    The queries run in parallel in `trials_fetcher`, while this function is the single writer that merges
+    the studies into the archive as they arrive. With combine, the conditions are packed into OR'ed queries
+    so that every study is downloaded once, and the studies are attributed locally to the conditions they match.
+
+    Parameters:
+    - conditions (list): The names of the medical conditions to search for in clinical trials.
+    - studies (dict, optional): An existing dictionary of studies to be updated. If None, the function will
+      fetch all existing studies using `get_all_studies()`. Default is None.
+    - since (str, optional): A date string in 'YYYY-MM-DD' format to filter trials updated since this date.
+      If False, no date filtering is applied. Default is False.
+    - save (bool, optional): Whether to write the archive to "trials/trials.json" after merging. Default is True.
+    - max_workers (int, optional): The number of queries running at the same time. Default is 4.
+    - requests_per_second (float, optional): The maximum request rate of all workers together. Default is 3.
+    - combine (bool, optional): Whether to combine the conditions into OR'ed queries. Default is True.
+    - projected (bool, optional): Whether to download only the fields in `trials_fetcher.STUDY_FIELDS`. Default is True.
+    - condition_index (ConditionIndex, optional): The condition index of the archive, kept up to date with the merged
+      studies. If None, it is built from the archive. Default is None.
+    - study_index (StudyIndex, optional): The index of update dates and fingerprints used to skip unchanged studies.
+      The changes of the run are collected in its `changes`. If None, it is loaded from "trials/study_index.json".
+    - failed_conditions (list, optional): Collects the conditions whose studies could not all be fetched. Default is None.
+    - save_index (bool, optional): Whether to save the study index together with the archive. Pass False when the
+      changes are graded afterwards, and save the index once they are, so that failed grading is retried. Default is True.
+
+    Returns:
+    - tuple: The dictionary of new studies by NCT ID and the updated dictionary of all studies.
+    """
     if not studies:
         studies = get_all_studies()
-    existing_ids = list(studies.keys())
-    response_data = {"nextPageToken": None}
-    responded_count = 0
-    all_new_ids = []
-    while "nextPageToken" in response_data.keys():
-        parameters = {"query.cond": condition_name, "pageSize": 1000}
-        if since:
-            parameters["filter.advanced"] = f"AREA[protocolSection.statusModule.lastUpdateSubmitDate]RANGE[{since}, MAX]"
-        try:
-            if response_data["nextPageToken"]:
-                parameters["pageToken"] = response_data["nextPageToken"]
-            response = requests.get(url, timeout=5, params=parameters)
-            response_data = response.json()
-        except JSONDecodeError as e:
-            print(str(e), str(response.text))
-            return {}
-        responded_count += len(response_data["studies"])
-        new_ids = [s["protocolSection"]["identificationModule"]["nctId"] for s in response_data["studies"] if s["protocolSection"]["identificationModule"]["nctId"] not in existing_ids]
-        all_new_ids += new_ids
-        studies.update({s["protocolSection"]["identificationModule"]["nctId"]: remove_large_leaves(s) for s in response_data["studies"]})
-        existing_ids += new_ids
-        if save:
-            with open("trials/trials.json", "w") as f:
-                f.write(json.dumps(studies, indent=4))
-
-    print("Found", f'{len(all_new_ids)} new studies of {responded_count} returned from the API while {len([s for k, s in studies.items() if condition_name.lower() in str(s["protocolSection"]["conditionsModule"]["conditions"]).lower()])}', "studies already exist in archive for", condition_name)
+    if condition_index is None:
+        condition_index = ConditionIndex(studies)
+    if study_index is None:
+        study_index = StudyIndex(studies=studies)
+    existing_ids = set(studies.keys())
+    responded_counts = {condition: 0 for condition in conditions}
+    new_ids = {condition: [] for condition in conditions}
+    all_new_ids = set()
+    unattributed = 0
+    pruner = LeafPruner()
+
+    fields = STUDY_FIELDS if projected else None
+    failed_conditions = failed_conditions if failed_conditions is not None else []
+    if combine:
+        fetched = fetch_combined_conditions(conditions, since, max_workers=max_workers, requests_per_second=requests_per_second, fields=fields, failed=failed_conditions)
+    else:
+        fetched = ((study, [condition]) for condition, page in fetch_conditions(conditions, since, max_workers=max_workers, requests_per_second=requests_per_second, fields=fields, failed=failed_conditions) for study in page)
+    for study, matched_conditions in fetched:
+        id = study_id(study)
+        is_new = id not in existing_ids
+        if is_new:
+            all_new_ids.add(id)
+            existing_ids.add(id)
+        unattributed += not matched_conditions
+        for condition in matched_conditions:
+            responded_counts[condition] += 1
+            if is_new:
+                new_ids[condition].append(id)
+        study = remove_large_leaves(add_results_digest(study), pruner=pruner)
+        fingerprint = study_fingerprint(study)
+        if not is_new and study_index.unchanged(id, study, fingerprint):
+            continue
+        old_study = studies.get(id)
+        # Taken before merging, which would carry the archived 'biie' over
+        downloaded_biie = study.get("biie", {})
+        if projected and old_study:
+            # The fields outside the projection are kept from the archived document
+            study = merge_projection(old_study, study)
+        if old_study and "biie" in old_study:
+            # Keep the local data but have the study graded again
+            study["biie"] = {**{key: value for key, value in old_study["biie"].items() if key not in ["relevance", "summary"]}, **downloaded_biie}
+        study_index.update(id, study, study_delta(old_study, study), fingerprint)
+        studies[id] = study
+        condition_index.add(id, study)
+
+    for condition in conditions:
+        print("Found", f'{len(new_ids[condition])} new studies of {responded_counts[condition]} returned from the API while {condition_index.count(condition)}', "studies already exist in archive for", condition)
+    if unattributed:
+        print(unattributed, "studies returned from the API did not match any condition by name")
+    if failed_conditions:
+        print("Could not fetch all studies for", ", ".join(failed_conditions))
+    if pruner.stats:
+        pruner.report(top=5)
+    print("Changes:", ", ".join(f"{count} {change_type}" for change_type, count in study_index.summary().items()) or "none")
+    if save and study_index.changes:
+        save_studies(studies)
+        if save_index:
+            study_index.save()
 
     return {k: s for k, s in studies.items() if k in all_new_ids}, studies
 
 
+def latest_trials_data_by_organization(profile, since=False):
+    parameters = {
+        "query.spons": profile["organization_name"],
+        "pageSize": 1000,
+        "fields": "protocolSection.identificationModule,protocolSection.conditionsModule,protocolSection.sponsorCollaboratorsModule"
+    }
+    try:
+        studies = next(fetch_pages(parameters), [])
+    except requests.exceptions.RequestException as e:
+        print("Could not fetch the studies of", profile["organization_name"], e)
+        return profile
+    print("Found", len(studies), "studies for", profile["organization_name"])
+    conditions = []
+    collaborators = []
+    for study in studies:
+        conditions += study["protocolSection"].get("conditionsModule", {}).get("conditions", [])
+        collaborators += [collaborator["name"] for collaborator in study["protocolSection"].get("sponsorCollaboratorsModule", {}).get("collaborators", [])]
+
+    unique_conditions = list(set(conditions))
+    condition_counts = {condition: conditions.count(condition) for condition in unique_conditions}
+    sorted_conditions = sorted(condition_counts.items(), key=lambda x: x[1], reverse=True)
+    profile["top5_conditions"] = sorted_conditions[:5]
+
+    unique_collaborators = list(set(collaborators))
+    collaborator_counts = {collaborator: collaborators.count(collaborator) for collaborator in unique_collaborators}
+    sorted_collaborators = sorted(collaborator_counts.items(), key=lambda x: x[1], reverse=True)
+    profile["top5_collaborators"] = sorted_collaborators[:5]
+    
+    return profile
+
+
 def describe_study(study, print_it=True, add_title=True):
     description = ""
     if add_title:
@@ -266,9 +350,10 @@ def describe_study(study, print_it=True, add_title=True):
     summary = summary.replace("\n", "").replace("<bullet> ", "\n• ")
 
     description += summary if add_title else summary[1:]
-    if study["protocolSection"]["statusModule"]["overallStatus"] == "COMPLETED" and study["hasResults"] and study.get("resultsSection"):
+    results_digest = study.get("biie", {}).get("results_digest") or compact_results(study.get("resultsSection"))
+    if study["protocolSection"]["statusModule"]["overallStatus"] == "COMPLETED" and study["hasResults"] and results_digest:
         description += "\nRESULTS:"
-        results = ask_ai("Please explain the primary outcome, observed adverse effects if any and the results for a clinical trial in up to 5 bullet points. Start each bullet with <bullet>, which I will later replace with the current symbol. Only provide bullets without any additional description. Trials data in JSON:\n" + json.dumps(study["resultsSection"]), always_shorten=True)
+        results = ask_ai("Please explain the primary outcome, observed adverse effects if any and the results for a clinical trial in up to 5 bullet points. Start each bullet with <bullet>, which I will later replace with the current symbol. Only provide bullets without any additional description. Trials results (groups are referred to by their ids):\n" + results_digest, always_shorten=True)
         results = results.replace("\n", "").replace("<bullet> ", "\n• ")
         description += results
     if print_it:
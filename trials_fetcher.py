@@ -0,0 +1,320 @@
+import concurrent.futures
+from json.decoder import JSONDecodeError
+import queue
+import re
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import say
+
+API_URL = "https://clinicaltrials.gov/api/v2/studies"
+TIMEOUT = (5, 30)
+PAGE_SIZE = 1000
+# Keep the query URLs well below the limits of servers and proxies
+MAX_URL_LENGTH = 2000
+PAGE_TOKEN_ALLOWANCE = 200
+RETRIED_STATUSES = [429, 500, 502, 503, 504]
+# The parts of a study that the trials jobs read, requested with the fields parameter of the API
+STUDY_FIELDS = [
+    "protocolSection.identificationModule",
+    "protocolSection.statusModule",
+    "protocolSection.designModule.phases",
+    "protocolSection.descriptionModule",
+    "protocolSection.conditionsModule",
+    "protocolSection.sponsorCollaboratorsModule",
+    "protocolSection.eligibilityModule.stdAges",
+    "hasResults",
+    "resultsSection"
+]
+_DONE = object()
+_MISSING = object()
+
+
+class RateLimiter:
+    """
+    Spaces out requests from all threads so that at most requests_per_second are started per second.
+    """
+
+    def __init__(self, requests_per_second=3):
+        self.interval = 1 / requests_per_second
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def create_session(max_workers=4):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=2)
+    session.mount("https://", adapter)
+    return session
+
+
+def project_study(study, fields=STUDY_FIELDS):
+    """
+    Keeps only the given dotted field paths of the study, like the fields parameter of the API does.
+    """
+    projected = {}
+    for field in fields:
+        value = study
+        for part in field.split("."):
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = projected
+            parts = field.split(".")
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return projected
+
+
+def merge_projection(document, projection, fields=STUDY_FIELDS):
+    """
+    Returns the archived document with the given dotted field paths replaced by those of a projected download,
+    keeping the fields outside the projection. Other top-level keys of the projection, such as 'biie', are copied
+    over as well. The document itself is not modified.
+    """
+    merged = dict(document)
+    roots = set(field.split(".")[0] for field in fields)
+    for field in fields:
+        parts = field.split(".")
+        value = projection
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                value = _MISSING
+                break
+            value = value[part]
+        target = merged
+        for part in parts[:-1]:
+            target[part] = dict(target[part]) if isinstance(target.get(part), dict) else {}
+            target = target[part]
+        if value is _MISSING:
+            target.pop(parts[-1], None)
+        else:
+            target[parts[-1]] = value
+    for key, value in projection.items():
+        if key not in roots:
+            merged[key] = value
+    return merged
+
+
+def condition_parameters(condition_name, since=False, fields=None):
+    parameters = {"query.cond": condition_name, "pageSize": PAGE_SIZE}
+    if since:
+        parameters["filter.advanced"] = f"AREA[protocolSection.statusModule.lastUpdateSubmitDate]RANGE[{since}, MAX]"
+    if fields:
+        parameters["fields"] = ",".join(fields)
+    return parameters
+
+
+def fetch_pages(parameters, session=None, limiter=None, max_retries=3):
+    """
+    Yields the studies of every page returned by the ClinicalTrials.gov API for the given query parameters.
+    Rate-limited and failed requests are retried with backoff.
+
+    Raises:
+        requests.exceptions.RequestException: If a page could not be fetched after the retries, so that
+        an incomplete download is not mistaken for a complete one.
+    """
+    session = session or create_session()
+    page_token = None
+    while True:
+        page_parameters = dict(parameters)
+        if page_token:
+            page_parameters["pageToken"] = page_token
+        for attempt in range(max_retries + 1):
+            if limiter:
+                limiter.wait()
+            try:
+                response = session.get(API_URL, timeout=TIMEOUT, params=page_parameters)
+            except requests.exceptions.RequestException as e:
+                response = None
+                error = e
+                say(f"Request to ClinicalTrials.gov failed: {e}")
+            if response is not None and response.status_code not in RETRIED_STATUSES:
+                break
+            if attempt < max_retries:
+                time.sleep(2 ** attempt)
+        if response is None:
+            print("Could not reach ClinicalTrials.gov for", parameters)
+            raise error
+        if response.status_code in RETRIED_STATUSES:
+            raise requests.exceptions.HTTPError(f"ClinicalTrials.gov responded {response.status_code} after {max_retries + 1} attempts", response=response)
+        try:
+            response_data = response.json()
+        except JSONDecodeError as e:
+            print(str(e), str(response.text))
+            raise requests.exceptions.RequestException(f"Invalid response from ClinicalTrials.gov: {e}")
+        yield response_data.get("studies", [])
+        page_token = response_data.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def fetch_conditions(conditions, since=False, max_workers=4, requests_per_second=3, parameters=condition_parameters, fields=None, failed=None):
+    """
+    Queries many conditions in parallel over a pooled session and yields the pages as they arrive.
+
+    The pages are handed over through a bounded queue, so the caller is the single writer of the results
+    and the downloads wait while it is busy merging. If the caller stops early, the downloads are stopped too.
+
+    Args:
+        conditions (list): The condition names to query.
+        since (str, optional): Only fetch studies updated since this 'YYYY-MM-DD' date. Defaults to False.
+        max_workers (int, optional): The number of conditions queried at the same time. Defaults to 4.
+        requests_per_second (float, optional): The maximum request rate of all workers together. Defaults to 3.
+        parameters (function, optional): Builds the query parameters of a condition, since date and fields.
+        fields (list, optional): Only download these fields of the studies, e.g. STUDY_FIELDS. Defaults to all fields.
+        failed (list, optional): Collects the conditions whose studies could not all be fetched.
+
+    Yields:
+        tuple: The condition and the list of studies of one page.
+    """
+    session = create_session(max_workers)
+    limiter = RateLimiter(requests_per_second)
+    pages = queue.Queue(maxsize=max_workers * 2)
+    stopped = threading.Event()
+    failed = failed if failed is not None else []
+
+    def put(item):
+        # Give up handing over once the caller has stopped reading
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch_condition(condition):
+        try:
+            for studies in fetch_pages(parameters(condition, since, fields), session, limiter):
+                if not put((condition, studies)):
+                    return
+        except Exception as e:
+            print(f"Failed to fetch trials for {condition}: {e}")
+            failed.append(condition)
+        finally:
+            put(_DONE)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for condition in conditions:
+            executor.submit(fetch_condition, condition)
+        remaining = len(conditions)
+        while remaining:
+            item = pages.get()
+            if item is _DONE:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        stopped.set()
+        # Unblock the workers that are waiting to hand over a page
+        while True:
+            try:
+                pages.get_nowait()
+            except queue.Empty:
+                break
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def condition_terms(condition_name):
+    return frozenset(re.findall(r"\w+", condition_name.lower()))
+
+
+def remove_covered_conditions(conditions):
+    """
+    Drops the conditions whose query is already covered by a broader tracked condition,
+    e.g. 'pediatric malaria' is covered by 'malaria' because the search matches on terms.
+    """
+    terms = {condition: condition_terms(condition) for condition in conditions}
+    broadest = []
+    for condition in sorted(set(conditions), key=lambda c: len(terms[c])):
+        if terms[condition] and not any(terms[other] <= terms[condition] for other in broadest):
+            broadest.append(condition)
+    return broadest
+
+
+def condition_expression(conditions):
+    """
+    ORs the conditions together. Multi-word conditions are grouped in parentheses rather than quoted, so each one
+    matches its terms like its own query.cond does and not only the exact phrase.
+    """
+    return " OR ".join(f"({condition})" if " " in condition else condition for condition in conditions)
+
+
+def combine_conditions(conditions, since=False, max_url_length=MAX_URL_LENGTH, fields=None):
+    """
+    Packs the conditions into as few OR'ed query.cond expressions as the URL length limit allows.
+    Conditions covered by a broader condition are left out, as their studies are returned by the broader one.
+
+    Returns:
+        list: The query.cond expressions.
+    """
+    # Room for the page token of the following pages
+    budget = max_url_length - len(API_URL) - PAGE_TOKEN_ALLOWANCE
+    expressions = []
+    group = []
+    for condition in remove_covered_conditions(conditions):
+        candidate = condition_expression(group + [condition])
+        if group and len(urllib.parse.urlencode(condition_parameters(candidate, since, fields))) > budget:
+            expressions.append(condition_expression(group))
+            group = []
+        group.append(condition)
+    if group:
+        expressions.append(condition_expression(group))
+    return expressions
+
+
+def study_terms(study):
+    protocol = study.get("protocolSection", {})
+    texts = protocol.get("conditionsModule", {}).get("conditions", []) + protocol.get("conditionsModule", {}).get("keywords", [])
+    texts += [protocol.get("identificationModule", {}).get("officialTitle", ""), protocol.get("identificationModule", {}).get("briefTitle", "")]
+    return set(re.findall(r"\w+", " ".join(texts).lower()))
+
+
+def attribute_study(study, conditions):
+    """
+    Returns the tracked conditions whose terms all appear in the conditions, keywords or titles of the study.
+    """
+    terms = study_terms(study)
+    return [condition for condition in conditions if condition_terms(condition) <= terms]
+
+
+def fetch_combined_conditions(conditions, since=False, max_workers=4, requests_per_second=3, fields=None, failed=None):
+    """
+    Downloads the studies of all conditions with combined OR'ed queries, so that studies matching several
+    overlapping conditions are downloaded only once, and attributes every study locally to the conditions it matches.
+    The conditions of the queries that could not be fetched, and the conditions they cover, are added to failed.
+
+    Yields:
+        tuple: The study and the list of tracked conditions it is attributed to, which may be empty
+        when the API matched the study on a synonym.
+    """
+    seen = set()
+    failed_expressions = []
+    expressions = combine_conditions(conditions, since, fields=fields)
+    say(f"Querying {len(conditions)} conditions with {len(expressions)} combined queries")
+    for expression, page in fetch_conditions(expressions, since, max_workers=max_workers, requests_per_second=requests_per_second, fields=fields, failed=failed_expressions):
+        for study in page:
+            id = study["protocolSection"]["identificationModule"]["nctId"]
+            if id in seen:
+                continue
+            seen.add(id)
+            yield study, attribute_study(study, conditions)
+    if failed is not None and failed_expressions:
+        failed_terms = [condition_terms(condition) for expression in failed_expressions for condition in expression.split(" OR ")]
+        failed += [condition for condition in conditions if any(terms <= condition_terms(condition) for terms in failed_terms)]
@@ -0,0 +1,168 @@
+import argparse
+import collections
+import gzip
+import json
+import multiprocessing
+import os
+import zipfile
+
+from pruning import LeafPruner
+from trials_fetcher import attribute_study, merge_projection, project_study
+from trial_grading import queue_for_grading
+from trial_results import add_results_digest
+from trials_index import StudyIndex, study_fingerprint
+from utils import say
+
+TRIALS_FILE = "trials/trials.json"
+# Number of documents handed to the worker processes at a time, which bounds the memory use
+BATCH_SIZE = 2000
+
+
+def iter_dump_documents(path):
+    """
+    Yields the raw JSON documents of a ClinicalTrials.gov bulk export, either a zip of per-study
+    JSON files or a JSON lines file (optionally gzipped), one at a time.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith(".json"):
+                    yield archive.read(name)
+        return
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as dump:
+        for line in dump:
+            if line.strip():
+                yield line
+
+
+def parse_document(raw, conditions=None):
+    """
+    Parses, projects and prunes one study document in a worker process. The compact results are
+    extracted before pruning.
+
+    Returns:
+        tuple: The NCT ID and the study, or None if the document is invalid or matches none of the conditions.
+    """
+    try:
+        study = json.loads(raw)
+        id = study["protocolSection"]["identificationModule"]["nctId"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    study = LeafPruner().prune(add_results_digest(project_study(study)))
+    if conditions and not attribute_study(study, conditions):
+        return None
+    return id, study
+
+
+def _parse_batch(arguments):
+    batch, conditions = arguments
+    return [parsed for parsed in (parse_document(raw, conditions) for raw in batch) if parsed]
+
+
+def parse_in_pool(pool, batches, window):
+    """
+    Parses the batches in the pool and yields the results in order, with at most window batches in flight.
+    Pool.imap would read the whole dump ahead of the workers.
+    """
+    pending = collections.deque()
+    for batch in batches:
+        pending.append(pool.apply_async(_parse_batch, (batch,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def iter_batches(documents, size=BATCH_SIZE):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_dump(path, conditions=None, trials_file=TRIALS_FILE, processes=None):
+    """
+    Imports a ClinicalTrials.gov bulk export into the trials archive.
+
+    The documents are parsed, projected to STUDY_FIELDS and pruned in worker processes a batch at a time,
+    and every study is written out as soon as its batch is done, so the memory use is bounded by the archive
+    and a couple of batches rather than by the size of the dump. Imported studies are merged into their archived
+    versions, which keep their fields outside the projection and their local 'biie' data unless they changed.
+    Graded studies that changed lose their grade and are queued for the next grading run.
+
+    Args:
+        path (str): The zip or JSON lines file of the export.
+        conditions (list, optional): Only import the studies attributed to these conditions. Defaults to all studies.
+        trials_file (str, optional): The archive to write. Defaults to TRIALS_FILE.
+        processes (int, optional): The number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        int: The number of imported studies.
+    """
+    try:
+        with open(trials_file, "r") as studies_file:
+            studies = json.load(studies_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        studies = {}
+    study_index = StudyIndex(studies=studies)
+    imported = set()
+    regrade = set()
+    temporary_file = trials_file + ".tmp"
+    with open(temporary_file, "w") as output, multiprocessing.Pool(processes) as pool:
+        output.write("{")
+        separator = "\n"
+        batches = ((batch, conditions) for batch in iter_batches(iter_dump_documents(path)))
+        for parsed in parse_in_pool(pool, batches, window=2 * (processes or os.cpu_count() or 1)):
+            for id, study in parsed:
+                if id in imported:
+                    continue
+                fingerprint = study_fingerprint(study)
+                old_study = studies.get(id)
+                # Taken before merging, which would carry the archived 'biie' over
+                downloaded_biie = study.get("biie", {})
+                if old_study:
+                    # The fields outside the projection are kept from the archived document
+                    study = merge_projection(old_study, study)
+                if old_study and "biie" in old_study:
+                    if study_index.unchanged(id, study, fingerprint):
+                        study["biie"] = {**old_study["biie"], **downloaded_biie}
+                    else:
+                        study["biie"] = {**{key: value for key, value in old_study["biie"].items() if key not in ["relevance", "summary"]}, **downloaded_biie}
+                        if "relevance" in old_study["biie"]:
+                            regrade.add(id)
+                study_index.update(id, study, [{"type": "imported"}], fingerprint)
+                imported.add(id)
+                output.write(f"{separator}{json.dumps(id)}: {json.dumps(study)}")
+                separator = ",\n"
+            say(f"Imported {len(imported)} studies")
+        for id, study in studies.items():
+            if id not in imported:
+                output.write(f"{separator}{json.dumps(id)}: {json.dumps(study)}")
+                separator = ",\n"
+        output.write("\n}")
+    os.replace(temporary_file, trials_file)
+    # The index marks the changes as seen, so they are only graded through the queue
+    queue_for_grading(regrade)
+    study_index.save()
+    if regrade:
+        print(f"Queued {len(regrade)} changed studies for grading")
+    print(f"Imported {len(imported)} studies from {path}, the archive now has {len(imported | set(studies))} studies")
+    return len(imported)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a ClinicalTrials.gov bulk export into trials/trials.json.")
+    parser.add_argument("path", help="The zip of JSON files or the JSON lines file of the export")
+    parser.add_argument("--all", action="store_true", help="Import all studies instead of those matching trials/conditions.json")
+    parser.add_argument("--processes", type=int, default=None, help="The number of worker processes")
+    args = parser.parse_args()
+    tracked_conditions = None
+    if not args.all:
+        with open("trials/conditions.json", "r") as file:
+            tracked_conditions = json.load(file)
+    import_dump(args.path, tracked_conditions, processes=args.processes)
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import re
+
+from trials_fetcher import project_study
+
+STUDY_INDEX_FILE = "trials/study_index.json"
+# The fields the fingerprints are computed over. They are fixed rather than taken from STUDY_FIELDS, so that
+# requesting more fields does not change every fingerprint and report all archived studies as updated.
+FINGERPRINT_FIELDS = [
+    "protocolSection.identificationModule",
+    "protocolSection.statusModule",
+    "protocolSection.designModule.phases",
+    "protocolSection.descriptionModule",
+    "protocolSection.conditionsModule",
+    "protocolSection.sponsorCollaboratorsModule",
+    "hasResults",
+    "resultsSection"
+]
+
+
+def normalize_terms(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def study_conditions(study):
+    return study.get("protocolSection", {}).get("conditionsModule", {}).get("conditions", [])
+
+
+class TermIndex:
+    """
+    Inverted index from normalized terms of the studies to NCT IDs. The texts of a study are given by
+    the extract function, e.g. its conditions or its sponsor names.
+
+    A query matches a study if all of its terms appear in the texts of the study, so a query is an
+    intersection of a few posting sets instead of a scan of the archive.
+    """
+
+    def __init__(self, studies=None, extract=study_conditions):
+        self.extract = extract
+        self.postings = {}
+        self.terms_by_id = {}
+        for id, study in (studies or {}).items():
+            self.add(id, study)
+
+    def add(self, id, study):
+        """
+        Adds the study to the index, replacing the terms of an earlier version of it.
+        """
+        self.remove(id)
+        terms = normalize_terms(" ".join(self.extract(study)))
+        self.terms_by_id[id] = terms
+        for term in terms:
+            self.postings.setdefault(term, set()).add(id)
+
+    def remove(self, id):
+        for term in self.terms_by_id.pop(id, ()):
+            posting = self.postings[term]
+            posting.discard(id)
+            if not posting:
+                del self.postings[term]
+
+    def query(self, text):
+        """
+        Returns the set of NCT IDs of the studies whose texts contain all the terms of the text.
+        """
+        terms = normalize_terms(text)
+        if not terms:
+            return set()
+        postings = sorted((self.postings.get(term, set()) for term in terms), key=len)
+        return set.intersection(*postings) if postings[0] else set()
+
+    def count(self, text):
+        return len(self.query(text))
+
+
+class ConditionIndex(TermIndex):
+    """
+    Term index of the study conditions.
+
+    Usage:
+        index = ConditionIndex(studies)
+        index.add(nct_id, study)
+        index.count("pediatric malaria")
+    """
+
+    def __init__(self, studies=None):
+        super().__init__(studies, extract=study_conditions)
+
+
+def study_fingerprint(study):
+    """
+    Hash of the FINGERPRINT_FIELDS of the study, so full archived documents and projected downloads of
+    the same version have the same fingerprint.
+    """
+    content = project_study(study, FINGERPRINT_FIELDS)
+    return hashlib.sha1(json.dumps(content, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def last_update_post_date(study):
+    return study.get("protocolSection", {}).get("statusModule", {}).get("lastUpdatePostDateStruct", {}).get("date")
+
+
+def study_delta(old, new):
+    """
+    Describes how a study changed as a list of typed changes, e.g. [{"type": "status", "from": "RECRUITING", "to": "COMPLETED"}].
+    The types are 'new', 'status', 'phase', 'results_posted' and 'updated' for any other change.
+    """
+    if old is None:
+        return [{"type": "new"}]
+    changes = []
+    old_status = old.get("protocolSection", {}).get("statusModule", {}).get("overallStatus")
+    new_status = new.get("protocolSection", {}).get("statusModule", {}).get("overallStatus")
+    if old_status != new_status:
+        changes.append({"type": "status", "from": old_status, "to": new_status})
+    old_phases = old.get("protocolSection", {}).get("designModule", {}).get("phases", [])
+    new_phases = new.get("protocolSection", {}).get("designModule", {}).get("phases", [])
+    if old_phases != new_phases:
+        changes.append({"type": "phase", "from": old_phases, "to": new_phases})
+    if new.get("hasResults") and not old.get("hasResults"):
+        changes.append({"type": "results_posted"})
+    return changes or [{"type": "updated"}]
+
+
+class StudyIndex:
+    """
+    Index from NCT ID to the lastUpdatePostDate and content fingerprint of the archived version of the study,
+    so that merges can skip the studies that did not change.
+
+    The changes found during a run are collected in `changes` by NCT ID.
+
+    Usage:
+        index = StudyIndex(studies=studies)
+        if not index.unchanged(nct_id, study):
+            index.update(nct_id, study, delta)
+        index.save()
+    """
+
+    def __init__(self, path=STUDY_INDEX_FILE, studies=None):
+        self.path = path
+        self.entries = {}
+        self.changes = {}
+        try:
+            with open(path, "r") as json_file:
+                self.entries = json.load(json_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            for id, study in (studies or {}).items():
+                self.entries[id] = [last_update_post_date(study), study_fingerprint(study)]
+
+    def __contains__(self, id):
+        return id in self.entries
+
+    def unchanged(self, id, study, fingerprint=None):
+        """
+        Returns whether the study is identical to its archived version. The fingerprint is only
+        computed when the update dates match.
+        """
+        entry = self.entries.get(id)
+        if entry is None or entry[0] != last_update_post_date(study):
+            return False
+        return entry[1] == (fingerprint or study_fingerprint(study))
+
+    def update(self, id, study, delta, fingerprint=None):
+        self.entries[id] = [last_update_post_date(study), fingerprint or study_fingerprint(study)]
+        self.changes[id] = delta
+
+    def summary(self):
+        """
+        Returns the number of changed studies by change type.
+        """
+        counts = {}
+        for delta in self.changes.values():
+            for change in delta:
+                counts[change["type"]] = counts.get(change["type"], 0) + 1
+        return counts
+
+    def save(self):
+        with open(self.path, "w") as json_file:
+            json.dump(self.entries, json_file)
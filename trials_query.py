@@ -0,0 +1,141 @@
+import bisect
+
+from study import Study
+from trials_index import TermIndex
+
+# Rank of the phases for minimum phase filters
+PHASE_RANKS = {"NA": 0, "EARLY_PHASE1": 0.5, "PHASE1": 1, "PHASE2": 2, "PHASE3": 3, "PHASE4": 4}
+
+
+class TrialQueryEngine:
+    """
+    Indexes the trials archive by phase, overall status, age group, condition, sponsor, collaborator,
+    last-update date and relevance, so that filters and rankings over it are answered from the indexes
+    without scanning the archive or calling the API.
+
+    The studies are kept as compact Study records, and documents given instead are converted on the way in.
+    Results, predicates and sort functions all see Study records.
+
+    Usage:
+        engine = TrialQueryEngine(get_all_studies(compact=True))
+        engine.query().condition("malaria").min_phase("PHASE2").status("RECRUITING").age("CHILD").sort_by("relevance").limit(10).studies()
+    """
+
+    def __init__(self, studies):
+        self.studies = {id: study if isinstance(study, Study) else Study.from_json(study) for id, study in studies.items()}
+        self.all_ids = set(self.studies)
+        self.phases = {}
+        self.statuses = {}
+        self.ages = {}
+        self.conditions = TermIndex(self.studies, extract=lambda study: study.conditions)
+        self.sponsors = TermIndex(self.studies, extract=lambda study: [study.lead_sponsor])
+        self.collaborators = TermIndex(self.studies, extract=lambda study: study.collaborators)
+        self.last_updates = {}
+        self.relevances = {}
+        for id, study in self.studies.items():
+            for phase in study.phases or ["NA"]:
+                self.phases.setdefault(phase, set()).add(id)
+            self.statuses.setdefault(study.overall_status, set()).add(id)
+            for age in study.std_ages:
+                self.ages.setdefault(age, set()).add(id)
+            self.last_updates[id] = study.last_update
+            if study.relevance is not None:
+                self.relevances[id] = study.relevance
+        # Sorted (value, id) lists for range filters
+        self.by_last_update = sorted((date, id) for id, date in self.last_updates.items())
+        self.by_relevance = sorted((score, id) for id, score in self.relevances.items())
+
+    def query(self):
+        return TrialQuery(self)
+
+    def updated_between(self, start=None, end=None):
+        low = bisect.bisect_left(self.by_last_update, (start or "",))
+        high = bisect.bisect_right(self.by_last_update, (end, "\uffff")) if end else len(self.by_last_update)
+        return set(id for _, id in self.by_last_update[low:high])
+
+    def relevance_at_least(self, score):
+        return set(id for _, id in self.by_relevance[bisect.bisect_left(self.by_relevance, (score, "")):])
+
+
+class TrialQuery:
+    """
+    Composable filter and sort over a TrialQueryEngine. Every filter narrows the result set, and
+    the methods return the query so that they can be chained.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.ids = None
+        self.sort_key = None
+        self.descending = True
+        self.max_results = None
+
+    def _narrow(self, ids):
+        self.ids = set(ids) if self.ids is None else self.ids & ids
+        return self
+
+    def phase(self, *phases):
+        return self._narrow(set().union(*(self.engine.phases.get(phase.upper(), set()) for phase in phases)))
+
+    def min_phase(self, phase):
+        rank = PHASE_RANKS[phase.upper()]
+        return self.phase(*[name for name, name_rank in PHASE_RANKS.items() if name_rank >= rank])
+
+    def status(self, *statuses):
+        return self._narrow(set().union(*(self.engine.statuses.get(status.upper(), set()) for status in statuses)))
+
+    def age(self, *ages):
+        return self._narrow(set().union(*(self.engine.ages.get(age.upper(), set()) for age in ages)))
+
+    def condition(self, condition):
+        return self._narrow(self.engine.conditions.query(condition))
+
+    def sponsor(self, name):
+        return self._narrow(self.engine.sponsors.query(name))
+
+    def collaborator(self, name):
+        return self._narrow(self.engine.collaborators.query(name))
+
+    def updated(self, since=None, until=None):
+        return self._narrow(self.engine.updated_between(since, until))
+
+    def min_relevance(self, score):
+        return self._narrow(self.engine.relevance_at_least(score))
+
+    def where(self, predicate):
+        """
+        Narrows the results with a function of the Study record for filters that have no index.
+        """
+        candidates = self.engine.all_ids if self.ids is None else self.ids
+        return self._narrow(set(id for id in candidates if predicate(self.engine.studies[id])))
+
+    def sort_by(self, key="relevance", descending=True):
+        """
+        Sorts the results by 'relevance', 'last_update' or a function of the Study record.
+        """
+        self.sort_key = key
+        self.descending = descending
+        return self
+
+    def limit(self, count):
+        self.max_results = count
+        return self
+
+    def nct_ids(self):
+        ids = self.engine.all_ids if self.ids is None else self.ids
+        if self.sort_key == "relevance":
+            key = lambda id: self.engine.relevances.get(id, -1)
+        elif self.sort_key == "last_update":
+            key = lambda id: self.engine.last_updates.get(id, "")
+        elif self.sort_key:
+            key = lambda id: self.sort_key(self.engine.studies[id])
+        else:
+            key = None
+        ids = sorted(ids, key=key, reverse=self.descending) if key else sorted(ids)
+        return ids[:self.max_results] if self.max_results else ids
+
+    def studies(self):
+        return [self.engine.studies[id] for id in self.nct_ids()]
+
+    def count(self):
+        return len(self.engine.all_ids if self.ids is None else self.ids)
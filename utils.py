@@ -1,33 +1,23 @@
 import json
 import os
 import re
-from decouple import config
 import json
 import threading
 
-import requests
-
 DEBUG = False
+# Guards the read-modify-write of the profile savefile, which several threads may save to at once
+_savefile_lock = threading.RLock()
 
 
 def post_to_slack(message, json_mode=False):
-    url = config("SLACK_WEBHOOK_URL")
-    if not json_mode:
-        headers = {
-            "Content-Type": "text/plain"
-        }
-        data = {
-            "text": message
-        }
-    else:
-        data = message
-        headers = {
-            "Content-Type": "application/json"
-        }
-
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code != 200:
-        print(f"Failed to post to Slack: {response.text}")
+    """
+    Posts a message to Slack and waits for the result. Use slack_delivery.SlackDeliveryQueue to post in the background.
+    """
+    from slack_delivery import send_to_slack, to_payload
+
+    payload, headers = to_payload(message, json_mode)
+    delivered, _, _ = send_to_slack(payload, headers)
+    if not delivered:
         if json_mode:
             print(json.dumps(message, indent=4))
         else:
@@ -36,6 +26,19 @@ def post_to_slack(message, json_mode=False):
     return True
 
 
+def load_settings():
+    with open("news/news_settings.json", "r") as json_file:
+        settings = json.load(json_file)
+    return settings
+
+
+def save_settings(key, new_value):
+    settings = load_settings()
+    settings[key] = new_value
+    with open("news/news_settings.json", "w") as json_file:
+        json.dump(settings, json_file, indent=4)
+
+
 def clean_string(input_string):
     # Replace whitespace with underscores
     underscore_string = input_string.replace(' ', '_')
@@ -117,17 +120,20 @@ def save_question(savefile, question):
     :param savefile: str, the path to the savefile file
     :param profile: tuple, the question
     """
-    # Load existing questions from the savefile file
-    with open(savefile, "r") as file:
-        data = json.load(file)
+    with _savefile_lock:
+        # Load existing questions from the savefile file
+        with open(savefile, "r") as file:
+            data = json.load(file)
 
-    # Save the question to the questions list
-    if question[0] not in [q[0] for q in data["questions"]]:
-        data["questions"].append(question)
+        # Save the question to the questions list
+        if question[0] not in [q[0] for q in data["questions"]]:
+            data["questions"].append(question)
+        _update_coverage(data, [])
 
-    # Save the data to the savefile file
-    with open(savefile, "w") as file:
-        json.dump(data, file, indent=4)
+        # Save the data to the savefile file
+        with open(savefile + ".tmp", "w") as file:
+            json.dump(data, file, indent=4)
+        os.replace(savefile + ".tmp", savefile)
 
 
 def save_profile(savefile, organization_name, profile):
@@ -138,20 +144,64 @@ def save_profile(savefile, organization_name, profile):
     :param organization_name: str, the name of the organization
     :param profile: dict, the organization profile
     """
-    lock = threading.Lock()  # Create a lock object
-
-    with lock:
+    with _savefile_lock:
         # Load existing profiles from the savefile file
         with open(savefile, "r") as file:
             data = json.load(file)
 
         # Save the organization profile to the profiles dictionary
         data["profiles"][organization_name] = profile
+        _update_coverage(data, [organization_name])
+
+        # Write a temporary file and swap it in, so that an interrupted save cannot corrupt the savefile
+        with open(savefile + ".tmp", "w") as file:
+            json.dump(data, file, indent=4)
+        os.replace(savefile + ".tmp", savefile)
+
+
+def save_profiles(savefile, profiles):
+    """
+    Save several organization profiles to the savefile file at once.
 
-        # Save the profiles dictionary to the savefile file
-        with open(savefile, "w") as file:
+    :param savefile: str, the path to the savefile file
+    :param profiles: dict, the organization profiles by organization name
+    """
+    with _savefile_lock:
+        with open(savefile, "r") as file:
+            data = json.load(file)
+
+        data["profiles"].update(profiles)
+        _update_coverage(data, list(profiles))
+
+        with open(savefile + ".tmp", "w") as file:
             json.dump(data, file, indent=4)
+        os.replace(savefile + ".tmp", savefile)
+
+
+def load_coverage(savefile):
+    """
+    Load the question coverage of the savefile, building and saving it first if the savefile has none.
+
+    :param savefile: str, the path to the savefile file
+    :return: dict, the coverage as saved by org_questions.QuestionCoverage.to_json
+    """
+    with _savefile_lock:
+        with open(savefile, "r") as file:
+            data = json.load(file)
+        if "organizations" not in data.get("coverage", {}):
+            # Savefiles without a coverage, or with the earlier one without the organizations
+            _update_coverage(data)
+            with open(savefile + ".tmp", "w") as file:
+                json.dump(data, file, indent=4)
+            os.replace(savefile + ".tmp", savefile)
+    return data["coverage"]
+
+
+def _update_coverage(data, organization_names=None):
+    # org_questions imports this module
+    from org_questions import update_coverage
 
+    update_coverage(data, organization_names)
 
 
 # === UI TOOLS ===
@@ -0,0 +1,215 @@
+import concurrent.futures
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+import json
+import os
+import re
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import get_cache
+from utils import say
+
+CACHE_FILE = "news/wiki_cache.json"
+# Cached intros are served without asking Wikipedia for this long, after that they are revalidated
+MAX_AGE = timedelta(days=30)
+TIMEOUT = (5, 15)
+CHUNK_SIZE = 16 * 1024
+# The first paragraph of an article comes well before this many bytes
+MAX_PAGE_BYTES = 512 * 1024
+
+
+class IntroParser(HTMLParser):
+    """
+    Incremental parser that picks the text of the first content paragraph of a Wikipedia article
+    and stops as soon as that paragraph has ended.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.in_content = False
+        self.in_paragraph = False
+        self.done = False
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        classes = (dict(attrs).get("class") or "").split()
+        if tag == "div" and "mw-content-ltr" in classes:
+            self.in_content = True
+        elif tag == "p" and self.in_content and "mw-empty-elt" not in classes:
+            self.in_paragraph = True
+            self.parts = []
+
+    def handle_endtag(self, tag):
+        if tag == "p" and self.in_paragraph:
+            self.in_paragraph = False
+            # Skip paragraphs that only contain whitespace
+            if "".join(self.parts).strip():
+                self.done = True
+
+    def handle_data(self, data):
+        if self.in_paragraph and not self.done:
+            self.parts.append(data)
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+
+class WikipediaIntroService:
+    """
+    Fetches the intro paragraphs of Wikipedia articles over a pooled session.
+
+    Intros are kept in an on-disk cache. Entries older than MAX_AGE are revalidated through the HTTP cache
+    with a conditional request, so unchanged pages are not downloaded or parsed again. Only the first
+    MAX_PAGE_BYTES of a page are read, and parsing stops once the first paragraph has been read.
+    In the offline mode of the HTTP cache, cached intros are served however old they are.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE, max_workers=8, timeout=TIMEOUT, http_cache=None):
+        self.cache_file = cache_file
+        self.http_cache = http_cache or get_cache()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "ie_research_map (https://github.com/Wing0/ie_research_map)"
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=2)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = {}
+        try:
+            with open(cache_file, "r") as json_file:
+                self.cache = json.load(json_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.cache = {}
+
+    def fetch(self, url, save=True):
+        """
+        Returns the intro text of the article, from the cache when it is fresh, or None if it could not be fetched.
+        Failures are not cached, so the next call tries again.
+        """
+        with self._lock:
+            entry = self.cache.get(url)
+        if entry and (self.http_cache.offline or datetime.now() - datetime.fromisoformat(entry["checked"]) < MAX_AGE):
+            return entry["intro"]
+
+        # The HTTP cache revalidates the page with its ETag and Last-Modified headers
+        response = self.http_cache.get(url, session=self.session, ttl=0, max_bytes=MAX_PAGE_BYTES, timeout=self.timeout)
+        if response is None:
+            return entry["intro"] if entry else None
+        if response.status_code != 200:
+            print(f"Error: {response.status_code}:\n{response.text[:200]}")
+            return entry["intro"] if entry else None
+        text = entry["intro"] if entry and response.from_cache else self._read_intro(response.text)
+
+        with self._lock:
+            self.cache[url] = {"intro": text, "checked": datetime.now().isoformat()}
+        if save:
+            self.save()
+        return text
+
+    def _read_intro(self, html):
+        parser = IntroParser()
+        for start in range(0, len(html), CHUNK_SIZE):
+            parser.feed(html[start:start + CHUNK_SIZE])
+            if parser.done:
+                break
+        return re.sub(r'\[\d+\]', '', parser.text)
+
+    def fetch_many(self, urls):
+        """
+        Fetches the intros of many articles concurrently and saves the cache once.
+
+        Returns:
+            dict: The intro text by URL, None for the intros that could not be fetched.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            texts = dict(zip(urls, executor.map(lambda url: self.fetch(url, save=False), urls)))
+        self.save()
+        return texts
+
+    def prefetch(self, url):
+        """
+        Starts fetching the intro in the background, so that a later fetch is served from the cache.
+        """
+        with self._lock:
+            if url in self._pending or url in self.cache:
+                return
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+            self._pending[url] = self._executor.submit(self.fetch, url, False)
+
+    def wait(self):
+        """
+        Waits for the background fetches to finish and saves the cache.
+
+        Returns:
+            dict: The intro text by URL, None for the intros that could not be fetched.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        texts = {}
+        for url, future in pending.items():
+            try:
+                texts[url] = future.result()
+            except Exception as e:
+                print(f"Error: Could not fetch the intro of {url}: {e}")
+                texts[url] = None
+        self.save()
+        return texts
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+            with open(self.cache_file, "w") as json_file:
+                json.dump(self.cache, json_file, indent=4)
+
+
+_service = None
+
+
+def get_service():
+    """
+    Returns the shared intro service of this process.
+    """
+    global _service
+    if _service is None:
+        _service = WikipediaIntroService()
+    return _service
+
+
+def fill_wikipedia_intros(all_concepts):
+    """
+    Adds the Wikipedia intro to every concept that has a Wikipedia URI but no intro yet, downloading them concurrently.
+    The intros of the concepts created during the run are already being prefetched, so those are only waited for.
+
+    Args:
+        all_concepts (dict): The contents of news/concepts.json, updated in place.
+
+    Returns:
+        int: The number of concepts that were updated.
+    """
+    service = get_service()
+    texts = service.wait()
+    missing = [concept for concept in all_concepts["concepts"].values() if "wikipedia.org" in concept["uri"] and concept.get("wiki", {}).get("shortly") is None and "wiki" in concept]
+    if not missing:
+        return 0
+    # Prefetches that failed are not tried again before the next run
+    unfetched = [concept["uri"] for concept in missing if concept["uri"] not in texts]
+    if unfetched:
+        say(f"Fetching Wikipedia intros for {len(unfetched)} concepts...")
+        texts.update(service.fetch_many(unfetched))
+    updated = 0
+    for concept in missing:
+        # Failed downloads stay missing and are tried again on the next run
+        if texts[concept["uri"]] is not None:
+            concept["wiki"]["shortly"] = texts[concept["uri"]]
+            updated += 1
+    return updated